@@ -0,0 +1,3 @@
+from evlcharts.cli import main
+
+main()
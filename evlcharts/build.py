@@ -0,0 +1,711 @@
+"""
+Rebuild only the counties whose inputs have actually changed.
+
+make decides what to rebuild from modification times, so rebuilding
+the joined data, even when only a few counties' rows changed, makes
+every county data file, params file, plot and map out of date. This
+driver instead records hashes of what each stage of each county was
+built from in a stamp store, and reruns a stage for a county only when
+one of them changes. The inputs of the stages are
+
+* data: the county's rows of the joined data,
+* params: the county data file,
+* plot: the county data file, the params the models are fit with and
+  the county names files passed with `--county-names`,
+* maps: the county data file,
+
+and, for every stage, its arguments and the version of the code it
+runs, which is a hash of the sources of the evlcharts modules it
+imports and the versions of the packages they use.
+
+With `--dry-run` nothing is run. The counties and stages that would
+be rebuilt are listed with the reasons why.
+"""
+
+import ast
+import csv
+import hashlib
+import json
+import logging
+import shlex
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import evlcharts.loader as loader
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+# The stages in the order they run, and the command each one runs.
+STAGES = {
+    "data": "select",
+    "params": "optimize",
+    "plot": "plot",
+    "maps": "maps",
+}
+
+# Third party packages whose versions are part of the code version.
+VERSIONED_PACKAGES = [
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "scikit-learn",
+    "xgboost",
+    "shap",
+    "impactchart",
+    "matplotlib",
+    "geopandas",
+]
+
+# Options in each stage's arguments that name files the stage reads,
+# whose contents are inputs of the stage along with the arguments.
+FILE_OPTIONS = {
+    "plot": ["--county-names"],
+}
+
+_PACKAGE_DIR = Path(__file__).parent
+
+
+def _imported_modules(path: Path) -> Set[str]:
+    """The evlcharts modules a source file imports, anywhere in the file."""
+    tree = ast.parse(path.read_text(), filename=str(path))
+
+    modules = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(
+                alias.name
+                for alias in node.names
+                if alias.name.startswith("evlcharts.")
+            )
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            if node.module == "evlcharts":
+                modules.update(f"evlcharts.{alias.name}" for alias in node.names)
+            elif node.module.startswith("evlcharts."):
+                modules.add(node.module)
+
+    return modules
+
+
+def module_sources(module: str) -> List[Path]:
+    """The source files of an evlcharts module and every evlcharts module it imports."""
+    pending = [module]
+    sources = {}
+
+    while pending:
+        name = pending.pop()
+        path = _PACKAGE_DIR / f"{name.removeprefix('evlcharts.')}.py"
+
+        if name in sources or not path.exists():
+            continue
+
+        sources[name] = path
+        pending.extend(_imported_modules(path))
+
+    return [sources[name] for name in sorted(sources)]
+
+
+def code_version(module: str) -> str:
+    """A hash of the code a module runs, to rebuild when it changes."""
+    h = hashlib.sha256()
+
+    for path in module_sources(module):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+
+    for package in VERSIONED_PACKAGES:
+        try:
+            package_version = version(package)
+        except PackageNotFoundError:
+            package_version = "missing"
+        h.update(f"{package}=={package_version}".encode())
+
+    return h.hexdigest()
+
+
+def args_hash(argv: List[str]) -> str:
+    """A hash of a command's arguments, ignoring the ones that don't change its output."""
+    kept = []
+    skip = False
+
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--log":
+            skip = True
+        elif not arg.startswith("--log="):
+            kept.append(arg)
+
+    return hashlib.sha256(json.dumps(kept).encode()).hexdigest()
+
+
+def option_files(argv: List[str], option: str) -> List[Path]:
+    """The files given for an option that takes one or more of them."""
+    files = []
+    taking = False
+
+    for arg in argv:
+        if arg == option:
+            taking = True
+        elif arg.startswith(f"{option}="):
+            files.append(Path(arg.removeprefix(f"{option}=")))
+            taking = False
+        elif arg.startswith("-"):
+            taking = False
+        elif taking:
+            files.append(Path(arg))
+
+    return files
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def params_hash(path: Path) -> str:
+    """
+    A hash of the parts of a params file the models are fit with.
+
+    Rerunning optimize rewrites the search details, such as its wall
+    time, even when it finds the same params, so those are left out.
+    """
+    with open(path) as f:
+        result = yaml.full_load(f)
+
+    fitted = {"xgb": result["xgb"]["params"], "linreg": result["linreg"]}
+
+    return hashlib.sha256(json.dumps(fitted, sort_keys=True).encode()).hexdigest()
+
+
+def _update_slice_hash(h, df: pd.DataFrame):
+    # Numeric columns can be read as ints in one chunk and as floats
+    # in another, e.g. when only some chunks have missing values, so
+    # they are all hashed as floats.
+    df = df.astype(
+        {col: np.float64 for col, dtype in df.dtypes.items() if dtype.kind in "iuf"}
+    )
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+
+
+def county_slice_hashes(
+    input_path: Path, fips_codes: Iterable[str], *, chunksize: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    Hash each county's rows of the joined data.
+
+    The hash of a county depends only on its own rows, in order, so it
+    changes when they do and not when other counties' rows do. If
+    `chunksize` is given, the input is read that many rows at a time.
+    """
+    fips_codes = list(fips_codes)
+
+    if chunksize is None:
+        chunks = iter([loader.read_data(input_path)])
+    else:
+        chunks = loader.read_chunks(input_path, chunksize=chunksize)
+
+    hashes = {}
+
+    for df_chunk in chunks:
+        if not hashes:
+            for fips in fips_codes:
+                hashes[fips] = hashlib.sha256(",".join(df_chunk.columns).encode())
+
+        county_rows = df_chunk.groupby(["STATE", "COUNTY"], sort=False).indices
+
+        for fips in fips_codes:
+            rows = county_rows.get((fips[:2], fips[2:]))
+            if rows is not None:
+                _update_slice_hash(hashes[fips], df_chunk.iloc[rows])
+
+    return {fips: h.hexdigest() for fips, h in hashes.items()}
+
+
+class StampStore:
+    """
+    A SQLite store of the hashes of the inputs each target was built from.
+
+    A target is a stage of one county. Its stamp is written only after
+    it is built successfully, so an interrupted build picks up where it
+    stopped.
+    """
+
+    def __init__(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS stamps ("
+            "stage TEXT, target TEXT, inputs TEXT, built REAL, "
+            "PRIMARY KEY (stage, target))"
+        )
+        self._connection.commit()
+
+    def get(self, stage: str, target: str) -> Optional[Dict[str, str]]:
+        """The input hashes a target was last built from, or `None`."""
+        row = self._connection.execute(
+            "SELECT inputs FROM stamps WHERE stage = ? AND target = ?",
+            (stage, target),
+        ).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def put(self, stage: str, target: str, inputs: Dict[str, str]):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO stamps VALUES (?, ?, ?, ?)",
+            (stage, target, json.dumps(inputs, sort_keys=True), time.time()),
+        )
+        self._connection.commit()
+
+
+def rebuild_reasons(
+    inputs: Dict[str, Optional[str]],
+    stamped: Optional[Dict[str, str]],
+    output_exists: bool,
+) -> List[str]:
+    """
+    Why a target needs to be rebuilt. Empty if it is up to date.
+
+    An input hash of `None` means the input is about to be rebuilt
+    itself, so its hash is not known yet.
+    """
+    if not output_exists:
+        return ["output missing"]
+
+    if stamped is None:
+        return ["no stamp"]
+
+    reasons = []
+
+    for name, value in inputs.items():
+        if value is None:
+            reasons.append(f"{name} will be rebuilt")
+        elif stamped.get(name) != value:
+            reasons.append(f"{name} changed")
+
+    return reasons
+
+
+class Build:
+    """
+    The targets of a build and the commands that build them.
+
+    Each stage's arguments are the ones make passes its command, less
+    the per-county ones, e.g. `--fips` and `-o`, which are added here.
+    """
+
+    def __init__(
+        self,
+        *,
+        joined_data: Path,
+        fips_codes: List[str],
+        data_dir: Path,
+        data_format: str,
+        params_dir: Path,
+        plot_dir: Path,
+        bucket_dir: Optional[Path],
+        bucket_format: str,
+        maps_dir: Path,
+        stage_args: Dict[str, List[str]],
+        stamps: StampStore,
+        population: str,
+        y_col: str,
+        socket: Optional[str] = None,
+        chunksize: Optional[int] = None,
+    ):
+        self.joined_data = joined_data
+        self.fips_codes = fips_codes
+        self.data_dir = data_dir
+        self.data_format = data_format
+        self.params_dir = params_dir
+        self.plot_dir = plot_dir
+        self.bucket_dir = bucket_dir
+        self.bucket_format = bucket_format
+        self.maps_dir = maps_dir
+        self.stage_args = stage_args
+        self.stamps = stamps
+        self.population = population
+        self.y_col = y_col
+        self.socket = socket
+        self.chunksize = chunksize
+
+        self.code_versions = {
+            stage: code_version(f"evlcharts.{command}")
+            for stage, command in STAGES.items()
+        }
+
+    def data_path(self, fips: str) -> Path:
+        return self.data_dir / f"{fips}.{self.data_format}"
+
+    def params_path(self, fips: str) -> Path:
+        return self.params_dir / f"xgb-params-{fips}.yaml"
+
+    def bucket_path(self, fips: str) -> Optional[Path]:
+        if self.bucket_dir is None:
+            return None
+        return self.bucket_dir / f"{fips}.{self.bucket_format}"
+
+    def outputs(self, stage: str, fips: str) -> List[Path]:
+        if stage == "data":
+            return [self.data_path(fips)]
+        if stage == "params":
+            return [self.params_path(fips)]
+        if stage == "plot":
+            bucket_path = self.bucket_path(fips)
+            return [self.plot_dir / fips] + ([bucket_path] if bucket_path else [])
+        return [self.maps_dir / fips]
+
+    def target(self, stage: str, fips: str) -> str:
+        # Data files are shared by every population and y column, and
+        # maps by every population.
+        if stage == "data":
+            return fips
+        if stage == "maps":
+            return f"{self.y_col}/{fips}"
+        return f"{self.population}/{self.y_col}/{fips}"
+
+    def command(self, stage: str, argv: List[str]) -> List[str]:
+        runner = [sys.executable, "-m", "evlcharts"]
+        if self.socket is not None:
+            runner += ["client", "--socket", self.socket]
+        return runner + [STAGES[stage]] + self.stage_args[stage] + argv
+
+    def county_argv(self, stage: str, fips: str) -> List[str]:
+        """The per-county arguments of the params, plot and maps commands."""
+        data_path = str(self.data_path(fips))
+
+        if stage == "params":
+            return ["--fips", fips, "-o", str(self.params_path(fips)), data_path]
+
+        if stage == "plot":
+            argv = ["-o", str(self.plot_dir / fips)]
+            argv += ["-p", str(self.params_path(fips)), "--fips", fips]
+            if self.bucket_dir is not None:
+                argv += ["--bucket", str(self.bucket_path(fips))]
+            return argv + [data_path]
+
+        return ["--fips", fips, "-o", str(self.maps_dir / fips), data_path]
+
+    def inputs(
+        self, stage: str, fips: str, slice_hashes: Dict[str, str], pending: Set[Path]
+    ) -> Dict[str, Optional[str]]:
+        """
+        The hashes of a target's inputs.
+
+        Inputs in `pending` are due to be rebuilt first, so their
+        hashes are `None`.
+        """
+
+        def hashed(path: Path, hasher: Callable[[Path], str]) -> Optional[str]:
+            if path in pending or not path.exists():
+                return None
+            return hasher(path)
+
+        if stage == "data":
+            inputs = {"slice": slice_hashes[fips]}
+        else:
+            inputs = {"data": hashed(self.data_path(fips), file_hash)}
+            if stage == "plot":
+                inputs["params"] = hashed(self.params_path(fips), params_hash)
+
+        for option in FILE_OPTIONS.get(stage, []):
+            files = [
+                (str(path), file_hash(path) if path.exists() else "missing")
+                for path in option_files(self.stage_args[stage], option)
+            ]
+            inputs[option.removeprefix("--")] = hashlib.sha256(
+                json.dumps(files).encode()
+            ).hexdigest()
+
+        inputs["args"] = args_hash(self.stage_args[stage])
+        inputs["code"] = self.code_versions[stage]
+
+        return inputs
+
+
+def run_commands(
+    commands: Dict[str, List[str]], jobs: int
+) -> Iterator[Tuple[str, int]]:
+    """
+    Run commands, `jobs` at a time.
+
+    Yields
+    ------
+        The key and exit status of each command, as it finishes.
+    """
+
+    def run(command: List[str]) -> int:
+        logger.info(f"Running {shlex.join(command[2:])}")
+        return subprocess.run(command).returncode
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(run, command): key for key, command in commands.items()
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def build_targets(
+    driver: Build,
+    stages: List[str],
+    *,
+    dry_run: bool = False,
+    mark_built: bool = False,
+    jobs: int = 1,
+) -> List[Dict[str, str]]:
+    """
+    Rebuild every target of `stages` that is out of date.
+
+    With `dry_run`, nothing is run or stamped. With `mark_built`,
+    nothing is run, but targets whose outputs exist are stamped as up
+    to date, e.g. to adopt a tree that make already built.
+
+    Returns
+    -------
+        A row for each target that is or would be rebuilt, or that
+        failed, with its stage, county and the reasons why.
+    """
+    slice_hashes = {}
+    if "data" in stages:
+        slice_hashes = county_slice_hashes(
+            driver.joined_data, driver.fips_codes, chunksize=driver.chunksize
+        )
+
+    report = []
+    pending: Set[Path] = set()
+    failed: Set[str] = set()
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+
+        stale = {}
+        current = 0
+
+        for fips in driver.fips_codes:
+            if fips in failed:
+                continue
+
+            inputs = driver.inputs(stage, fips, slice_hashes, pending)
+            target = driver.target(stage, fips)
+            outputs_exist = all(path.exists() for path in driver.outputs(stage, fips))
+
+            if mark_built:
+                if outputs_exist and None not in inputs.values():
+                    driver.stamps.put(stage, target, inputs)
+                continue
+
+            reasons = rebuild_reasons(
+                inputs, driver.stamps.get(stage, target), outputs_exist
+            )
+
+            if reasons:
+                stale[fips] = inputs
+                report.append(
+                    {"stage": stage, "fips": fips, "reasons": "; ".join(reasons)}
+                )
+            else:
+                current += 1
+
+        logger.info(f"{stage}: {len(stale)} to rebuild, {current} up to date.")
+
+        if dry_run:
+            for fips in stale:
+                pending.update(driver.outputs(stage, fips))
+            continue
+
+        if not stale:
+            continue
+
+        if stage == "data":
+            # All of the counties are split out of the joined data in
+            # a single pass.
+            argv = ["--fips", *stale, "--format", driver.data_format]
+            argv += ["-o", str(driver.data_dir), str(driver.joined_data)]
+            [(_, status)] = run_commands({"data": driver.command(stage, argv)}, 1)
+            statuses = ((fips, status) for fips in stale)
+        else:
+            statuses = run_commands(
+                {
+                    fips: driver.command(stage, driver.county_argv(stage, fips))
+                    for fips in stale
+                },
+                jobs,
+            )
+
+        for fips, status in statuses:
+            if status == 0:
+                driver.stamps.put(stage, driver.target(stage, fips), stale[fips])
+            else:
+                logger.error(f"Failed to build {stage} for {fips}.")
+                failed.add(fips)
+                report.append(
+                    {
+                        "stage": stage,
+                        "fips": fips,
+                        "reasons": f"failed with status {status}",
+                    }
+                )
+
+    return report
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List what would be rebuilt and why, without running anything.",
+    )
+    parser.add_argument(
+        "--mark-built",
+        action="store_true",
+        help="Stamp every target whose outputs exist as up to date, without "
+        "running anything, e.g. to adopt a tree make already built.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        default=["data", "params", "plot"],
+        help="Stages to build.",
+    )
+    parser.add_argument(
+        "--stamps",
+        required=True,
+        help="Stamp store of what each target was built from.",
+    )
+    parser.add_argument("--fips", nargs="+", required=True, help="Counties to build.")
+    parser.add_argument(
+        "--population",
+        choices=["all", "renters"],
+        default="renters",
+        help="Population the params and plots are for.",
+    )
+    parser.add_argument(
+        "-y",
+        "--y-column",
+        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        default="filing_rate",
+        help="Column the params, plots and maps are for.",
+    )
+    parser.add_argument("--data-dir", required=True, help="County data directory.")
+    parser.add_argument(
+        "--data-format",
+        choices=["csv", "parquet", "feather"],
+        default="csv",
+        help="Format of the county data files.",
+    )
+    parser.add_argument("--params-dir", help="Params directory.")
+    parser.add_argument("--plot-dir", help="Plot directory.")
+    parser.add_argument("--bucket-dir", help="Bucketed impact directory.")
+    parser.add_argument(
+        "--bucket-format",
+        choices=["csv", "parquet", "feather"],
+        default="parquet",
+        help="Format of the bucketed impact files.",
+    )
+    parser.add_argument("--maps-dir", help="Coverage maps directory.")
+    for stage, command in STAGES.items():
+        parser.add_argument(
+            f"--{stage}-args",
+            default="",
+            help=f"Other arguments for {command}, as one shell quoted string.",
+        )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Hash the joined data this many rows at a time.",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Run the commands on the server listening on this socket.",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Commands to run at once."
+    )
+    parser.add_argument(
+        "-o", "--report", help="CSV file to write the stage, county and reasons to."
+    )
+    parser.add_argument("input", help="The joined data.")
+
+    args = parser.parse_args()
+
+    for stage, directory in [
+        ("params", args.params_dir),
+        ("plot", args.plot_dir),
+        ("plot", args.params_dir),
+        ("maps", args.maps_dir),
+    ]:
+        if stage in args.stages and directory is None:
+            parser.error(f"The {stage} stage needs its directories.")
+
+    def optional_path(path: Optional[str]) -> Optional[Path]:
+        return Path(path) if path is not None else None
+
+    driver = Build(
+        joined_data=Path(args.input),
+        fips_codes=args.fips,
+        data_dir=Path(args.data_dir),
+        data_format=args.data_format,
+        params_dir=optional_path(args.params_dir),
+        plot_dir=optional_path(args.plot_dir),
+        bucket_dir=optional_path(args.bucket_dir),
+        bucket_format=args.bucket_format,
+        maps_dir=optional_path(args.maps_dir),
+        stage_args={
+            stage: shlex.split(getattr(args, f"{stage}_args")) for stage in STAGES
+        },
+        stamps=StampStore(Path(args.stamps)),
+        population=args.population,
+        y_col=args.y_column,
+        socket=args.socket,
+        chunksize=args.chunksize,
+    )
+
+    report = build_targets(
+        driver,
+        args.stages,
+        dry_run=args.dry_run,
+        mark_built=args.mark_built,
+        jobs=args.jobs,
+    )
+
+    if args.dry_run:
+        for row in report:
+            print(f"{row['stage']:<7} {row['fips']}  {row['reasons']}")
+
+    if args.report is not None:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["stage", "fips", "reasons"])
+            writer.writeheader()
+            writer.writerows(report)
+
+    if any(row["reasons"].startswith("failed") for row in report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+A concurrent client for the Census API.
+
+Requests run in threads under an asyncio event loop, so many of them can
+be in flight at once. The client bounds how many run concurrently,
+retries transient failures with exponential backoff, and coalesces
+identical requests that are in flight at the same time into one.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+CENSUS_API_URL = "https://api.census.gov/data"
+
+# Where API keys are read from if none is given on the command line.
+CENSUS_API_KEY_ENV = "CENSUS_API_KEY"
+
+# HTTP status codes worth retrying. Anything else is an error in the
+# request itself, which retrying won't fix.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code in RETRY_STATUSES
+
+    # HTTP errors from requests, which is what censusdis uses.
+    response = getattr(e, "response", None)
+    if response is not None:
+        return getattr(response, "status_code", None) in RETRY_STATUSES
+
+    # Connection errors and timeouts, from urllib or requests.
+    return isinstance(e, OSError) and not isinstance(
+        e, (FileNotFoundError, PermissionError)
+    )
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    if isinstance(e, urllib.error.HTTPError) and e.headers is not None:
+        retry_after = e.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+
+    return None
+
+
+class CensusClient:
+    """
+    Make Census API requests concurrently.
+
+    Parameters
+    ----------
+    base_url
+        The root of the API. Point this at :py:mod:`evlcharts.fakecensus`
+        to work without the network.
+    concurrency
+        The most requests to have in flight at once.
+    retries
+        How many times to retry a request that fails transiently.
+    backoff
+        Seconds to wait before the first retry. Each retry after that
+        waits twice as long, with some jitter.
+    timeout
+        Seconds to wait for a response.
+    api_key
+        An optional Census API key.
+    """
+
+    def __init__(
+        self,
+        *,
+        base_url: str = CENSUS_API_URL,
+        concurrency: int = 8,
+        retries: int = 4,
+        backoff: float = 0.5,
+        timeout: float = 60.0,
+        api_key: Optional[str] = None,
+    ):
+        self._base_url = base_url.rstrip("/")
+        self._concurrency = concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._api_key = api_key
+
+        # These belong to an event loop, so they are created by the
+        # first call in each loop.
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+        self.requests = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    async def _call_with_retries(self, fn: Callable, args: Tuple) -> Any:
+        for attempt in range(self._retries + 1):
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    return await asyncio.to_thread(fn, *args)
+                except Exception as e:
+                    if attempt == self._retries or not _is_transient(e):
+                        raise
+                    error = e
+
+            delay = _retry_after(error)
+            if delay is None:
+                delay = self._backoff * 2**attempt * (0.5 + random.random())
+
+            logger.info(f"Retrying in {delay:.2f}s after {error}")
+            self.retried += 1
+
+            # Sleep outside the semaphore so other requests can go ahead.
+            await asyncio.sleep(delay)
+
+    async def call(self, key: Hashable, fn: Callable, *args) -> Any:
+        """
+        Call `fn(*args)` in a thread, with bounded concurrency and retries.
+
+        If a call with the same `key` is already in flight, wait for its
+        result rather than making the same request again.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        if key in self._in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.ensure_future(self._call_with_retries(fn, args))
+        self._in_flight[key] = future
+
+        try:
+            return await future
+        finally:
+            del self._in_flight[key]
+
+    def _run(self, coroutines: Iterable[Awaitable]) -> List[Any]:
+        """Run coroutines concurrently in a new event loop and return their results."""
+
+        async def gather():
+            try:
+                return await asyncio.gather(*coroutines)
+            finally:
+                self._semaphore = None
+
+        return asyncio.run(gather())
+
+    def call_all(self, calls: Iterable[Tuple[Hashable, Callable, Tuple]]) -> List[Any]:
+        """
+        Make many calls concurrently from synchronous code.
+
+        Parameters
+        ----------
+        calls
+            `(key, fn, args)` tuples, as for :py:meth:`call`.
+
+        Returns
+        -------
+            The results, in the same order as `calls`.
+        """
+        return self._run(self.call(key, fn, *args) for key, fn, args in calls)
+
+    def _get_json(self, url: str) -> Any:
+        with urllib.request.urlopen(url, timeout=self._timeout) as response:
+            return json.load(response)
+
+    async def get(self, path: str, params: Dict[str, str]) -> List[List[str]]:
+        """Make an API request, returning the rows, including the header row."""
+        if self._api_key is not None:
+            params = {**params, "key": self._api_key}
+
+        url = f"{self._base_url}/{path}?{urllib.parse.urlencode(params, safe=':*,')}"
+
+        return await self.call(url, self._get_json, url)
+
+    async def state_county_names(self, state: str, vintage: int) -> Dict[str, str]:
+        """The names of every county in a state, from one request."""
+        rows = await self.get(
+            f"{vintage}/acs/acs5",
+            {"get": "NAME", "for": "county:*", "in": f"state:{state}"},
+        )
+
+        header, rows = rows[0], rows[1:]
+
+        name_col = header.index("NAME")
+        state_col = header.index("state")
+        county_col = header.index("county")
+
+        return {row[state_col] + row[county_col]: row[name_col] for row in rows}
+
+    def county_names(self, states: Iterable[str], vintage: int) -> Dict[str, str]:
+        """The names of every county in several states, fetched concurrently."""
+        states = list(states)
+
+        logger.info(
+            f"Downloading county names for {len(states)} states in {vintage} "
+            f"with up to {self._concurrency} requests at once."
+        )
+
+        names = {}
+        for state_names in self._run(
+            self.state_county_names(state, vintage) for state in states
+        ):
+            names.update(state_names)
+
+        return names
+
+
+def add_api_key_argument(parser):
+    """Add the `--census-api-key` option, which defaults to `$CENSUS_API_KEY`."""
+    parser.add_argument(
+        "--census-api-key",
+        default=os.environ.get(CENSUS_API_KEY_ENV),
+        help=f"Census API key. Defaults to ${CENSUS_API_KEY_ENV}, if it is set.",
+    )
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "--census-url",
+        default=CENSUS_API_URL,
+        help="Root of the Census API, or of a server from fakecensus.py.",
+    )
+    add_api_key_argument(parser)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    parser.add_argument("--vintage", type=int, default=2018)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Request each state this many times, to exercise coalescing.",
+    )
+    parser.add_argument("states", nargs="+", help="2 digit FIPS codes of states.")
+
+    args = parser.parse_args()
+
+    client = CensusClient(
+        base_url=args.census_url,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        backoff=args.backoff,
+        api_key=args.census_api_key,
+    )
+
+    start = time.perf_counter()
+    names = client.county_names(args.states * args.repeat, args.vintage)
+    elapsed = time.perf_counter() - start
+
+    logger.info(
+        f"Fetched {len(names)} county names in {elapsed:.2f}s with "
+        f"{client.requests} requests, {client.retried} retries and "
+        f"{client.coalesced} coalesced."
+    )
+
+
+if __name__ == "__main__":
+    main()
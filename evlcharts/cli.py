@@ -0,0 +1,64 @@
+"""
+A single entry point for every evlcharts command.
+
+    python -m evlcharts <command> [args ...]
+
+runs the same thing as `python -m evlcharts.<command> [args ...]`.
+Only the module for the command is imported, so light commands start
+quickly no matter what the heavy ones need. Keep this module free of
+imports beyond the standard library.
+"""
+
+import importlib
+import sys
+from argparse import REMAINDER, ArgumentParser, RawDescriptionHelpFormatter
+from typing import List, Optional
+
+# Every command and what it does.
+COMMANDS = {
+    "filterfips": "List the counties with enough data to model.",
+    "select": "Split the joined data into a file per county.",
+    "columnar": "Convert the joined data to a partitioned columnar dataset.",
+    "optimize": "Search for the best xgboost params for counties.",
+    "results": "Import params files into a results store.",
+    "topscore": "Sort counties by their optimized scores.",
+    "plot": "Fit an impact model for a county and plot impact charts.",
+    "rankbuckets": "Rank counties by bucketed impact gaps, or query the ranking.",
+    "maps": "Plot maps of the tracts we have data for.",
+    "countynames": "Look up county names.",
+    "rendersite": "Render the site's HTML from templates.",
+    "checksite": "Check the site for missing files.",
+    "build": "Rebuild only the counties whose inputs have changed.",
+    "censusapi": "Benchmark the concurrent Census API client.",
+    "fakecensus": "Serve a local stand-in for the Census API.",
+    "server": "Serve commands without per-command startup costs.",
+    "client": "Run a command on a server.",
+    "importcheck": "Check how long commands take to import.",
+}
+
+
+def command_module(command: str) -> str:
+    """The module that implements a command, which may also be given as a module."""
+    if command in COMMANDS:
+        return f"evlcharts.{command}"
+
+    return command
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = ArgumentParser(
+        prog="evlcharts",
+        description="Commands:\n"
+        + "\n".join(f"  {command:<12} {help}" for command, help in COMMANDS.items()),
+        formatter_class=RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("args", nargs=REMAINDER, help="Arguments for the command.")
+
+    args = parser.parse_args(argv)
+
+    command = importlib.import_module(command_module(args.command))
+
+    sys.argv = [f"evlcharts {args.command}"] + args.args
+
+    command.main()
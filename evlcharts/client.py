@@ -0,0 +1,119 @@
+"""
+Run an evlcharts command on a server from :py:mod:`evlcharts.server`.
+
+    python -m evlcharts client plot --fips 13121 ...
+
+behaves like
+
+    python -m evlcharts plot --fips 13121 ...
+
+but without importing anything heavy itself. If no server is listening,
+the command runs in this process instead.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+from evlcharts.cli import command_module
+from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.server import DEFAULT_SOCKET, reset_logging, run_module, send_request
+
+logger = logging.getLogger(__name__)
+
+
+def run_remote(path: str, module: str, argv) -> int:
+    """
+    Run a module on the server and return its exit status.
+
+    Raises
+    ------
+    ConnectionRefusedError, FileNotFoundError
+        If no server is listening on `path`.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+
+    with sock:
+        send_request(
+            sock,
+            {
+                "module": module,
+                "argv": list(argv),
+                "cwd": os.getcwd(),
+                "env": dict(os.environ),
+            },
+            [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()],
+        )
+
+        messages = sock.makefile("rb")
+        forwarded = []
+
+        def read_message():
+            line = messages.readline()
+            if not line:
+                raise ConnectionError(f"The server dropped {module}.")
+            return json.loads(line)
+
+        pid = read_message()["pid"]
+
+        def forward(signum, frame):
+            forwarded.append(signum)
+            os.kill(pid, signum)
+
+        for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+            signal.signal(signum, forward)
+
+        try:
+            return read_message()["status"]
+        except ConnectionError:
+            # The command died of a signal we passed on. Exit the way
+            # a shell reports that.
+            if forwarded:
+                return 128 + forwarded[-1]
+            raise
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "--socket", default=DEFAULT_SOCKET, help="Unix socket the server listens on."
+    )
+    parser.add_argument(
+        "--no-fallback",
+        action="store_true",
+        help="Fail rather than running locally if no server is listening.",
+    )
+    parser.add_argument(
+        "module",
+        help="The command to run, e.g. plot, or its module, e.g. evlcharts.plot.",
+    )
+    parser.add_argument(
+        "args", nargs=argparse.REMAINDER, help="Arguments for the module."
+    )
+
+    args = parser.parse_args()
+
+    args.module = command_module(args.module)
+
+    try:
+        status = run_remote(args.socket, args.module, args.args)
+    except (ConnectionRefusedError, FileNotFoundError):
+        if args.no_fallback:
+            logger.error(f"No server is listening on `{args.socket}`.")
+            sys.exit(1)
+
+        logger.info(f"No server on `{args.socket}`; running {args.module} here.")
+        reset_logging()
+        status = run_module(args.module, args.args)
+
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
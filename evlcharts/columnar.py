@@ -0,0 +1,41 @@
+import logging
+from pathlib import Path
+
+import evlcharts.loader as loader
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="Output dataset directory. A .parquet or .arrow suffix sets the format.",
+    )
+
+    parser.add_argument(
+        "input",
+        nargs="+",
+        help="Input files. The output of join.py and/or county files from select.py.",
+    )
+
+    args = parser.parse_args()
+
+    output_path = Path(args.output)
+
+    for input_file in args.input:
+        input_path = Path(input_file)
+
+        df = loader.read_data(input_path)
+
+        logger.info(f"Writing {len(df.index)} rows to dataset `{output_path}`")
+        loader.write_dataset(df, output_path)
+
+
+if __name__ == "__main__":
+    main()
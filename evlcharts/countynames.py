@@ -3,8 +3,9 @@ from pathlib import Path
 
 import pandas as pd
 
-import evlcharts.variables as var
+from evlcharts.censusapi import CENSUS_API_URL, CensusClient, add_api_key_argument
 from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.names import CountyNames
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,23 @@ def main():
         "-o", "--output-file", required=True, help="Output file for results."
     )
     parser.add_argument("--vintage", type=int, default=2018)
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Cache file for county names, so they are only downloaded once.",
+    )
+    parser.add_argument(
+        "--census-url",
+        default=CENSUS_API_URL,
+        help="Root of the Census API, or of a server from fakecensus.py.",
+    )
+    add_api_key_argument(parser)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="The most Census API requests to have in flight at once.",
+    )
     parser.add_argument(
         "cofips", nargs="+", type=str, help="5 digit FIPS codes of counties."
     )
@@ -24,11 +42,20 @@ def main():
 
     output_path = Path(args.output_file)
 
+    county_names = CountyNames(
+        args.vintage,
+        cache_path=Path(args.cache) if args.cache is not None else None,
+        client=CensusClient(
+            base_url=args.census_url,
+            concurrency=args.concurrency,
+            api_key=args.census_api_key,
+        ),
+    )
+
+    names = county_names.names(args.cofips)
+
     df = pd.DataFrame(
-        [
-            {"FIPS": cofips, "NAME": var.cofips_name(cofips, args.vintage)}
-            for cofips in args.cofips
-        ]
+        [{"FIPS": cofips, "NAME": names[cofips]} for cofips in args.cofips]
     )
 
     output_path.parent.mkdir(exist_ok=True, parents=True)
@@ -0,0 +1,179 @@
+"""A persistent cache of cross validated scores for hyperparameter searches."""
+
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _params_key(params: Dict[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True)
+
+
+class EvaluationCache:
+    """
+    A SQLite store of cross validated scores.
+
+    Each row maps a county data hash, y column, population, fold
+    scheme and candidate hyperparameters to the cross validated
+    target and the parameters the evaluator reported back.
+
+    Several processes can share one cache file, as they do when
+    make runs optimize with `-j`.
+    """
+
+    def __init__(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            "data_hash TEXT, y_col TEXT, population TEXT, scheme TEXT, "
+            "params TEXT, target REAL, result_params TEXT, "
+            "PRIMARY KEY (data_hash, y_col, population, scheme, params))"
+        )
+        self._connection.commit()
+
+    def get(
+        self, key: Dict[str, str], params: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Look up the evaluation of `params`, or `None` if we don't have it."""
+        row = self._connection.execute(
+            "SELECT target, result_params FROM evaluations WHERE "
+            "data_hash = ? AND y_col = ? AND population = ? AND scheme = ? "
+            "AND params = ?",
+            (
+                key["data_hash"],
+                key["y_col"],
+                key["population"],
+                key["scheme"],
+                _params_key(params),
+            ),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        target, result_params = row
+
+        return {"params": json.loads(result_params), "target": target}
+
+    def put(self, key: Dict[str, str], evaluations: List[Dict[str, Any]]):
+        """Store evaluations, each of which has the candidate's `"candidate"` params."""
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    key["data_hash"],
+                    key["y_col"],
+                    key["population"],
+                    key["scheme"],
+                    _params_key(evaluation["candidate"]),
+                    evaluation["target"],
+                    json.dumps(evaluation["params"], sort_keys=True),
+                )
+                for evaluation in evaluations
+            ],
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class CachedEvaluator:
+    """
+    Wraps an evaluator from :py:mod:`evlcharts.optimize` so that
+    candidates are looked up in an :py:class:`EvaluationCache` before
+    they are fit.
+
+    Candidates that miss are evaluated in chunks of `chunk_size`
+    and stored as each chunk finishes, so a search that is killed
+    part way through resumes from the last finished chunk.
+    """
+
+    def __init__(
+        self,
+        evaluator,
+        cache: EvaluationCache,
+        *,
+        data_hash: str,
+        y_col: str,
+        population: str,
+        chunk_size: int = 20,
+    ):
+        self._evaluator = evaluator
+        self._cache = cache
+        self._key = {
+            "data_hash": data_hash,
+            "y_col": y_col,
+            "population": population,
+        }
+        self._chunk_size = chunk_size
+
+        self.hits = 0
+
+    @property
+    def early_stopping(self) -> bool:
+        return self._evaluator.early_stopping
+
+    @property
+    def n_rows(self) -> int:
+        return self._evaluator.n_rows
+
+    @property
+    def n_splits(self) -> int:
+        return self._evaluator.n_splits
+
+    @property
+    def fits(self) -> int:
+        return self._evaluator.fits
+
+    def _scheme_key(self, n_samples: Optional[int]) -> Dict[str, str]:
+        scheme = self._evaluator.scheme
+        if n_samples is not None and n_samples < self.n_rows:
+            scheme = f"{scheme}-rows{n_samples}"
+
+        return {**self._key, "scheme": scheme}
+
+    def evaluate(
+        self, candidates: List[Dict[str, Any]], *, n_samples: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        key = self._scheme_key(n_samples)
+
+        evaluations: List[Optional[Dict[str, Any]]] = [
+            self._cache.get(key, params) for params in candidates
+        ]
+
+        misses = [ii for ii, evaluation in enumerate(evaluations) if evaluation is None]
+        self.hits += len(candidates) - len(misses)
+
+        logger.info(
+            f"Cache hits for {len(candidates) - len(misses)} of {len(candidates)} candidates."
+        )
+
+        for start in range(0, len(misses), self._chunk_size):
+            end = start + self._chunk_size
+            chunk = misses[start:end]
+
+            chunk_evaluations = self._evaluator.evaluate(
+                [candidates[ii] for ii in chunk], n_samples=n_samples
+            )
+
+            self._cache.put(
+                key,
+                [
+                    {**evaluation, "candidate": candidates[ii]}
+                    for ii, evaluation in zip(chunk, chunk_evaluations)
+                ],
+            )
+
+            for ii, evaluation in zip(chunk, chunk_evaluations):
+                evaluations[ii] = evaluation
+
+        return evaluations
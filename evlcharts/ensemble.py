@@ -0,0 +1,369 @@
+"""Fit impact model ensembles and compute their impacts in parallel."""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from impactchart.model import XGBoostImpactModel
+from threadpoolctl import threadpool_limits
+
+logger = logging.getLogger(__name__)
+
+
+def worker_threads(workers: int, threads: Optional[int] = None) -> int:
+    """
+    Threads each of `workers` workers may use.
+
+    If `threads` is given it caps the total across all of the
+    workers, so that several plots can run side by side under
+    `make -j` without oversubscribing the cores.
+    """
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    return max(1, threads // workers)
+
+
+# State of an impact worker process, set once by the initializer
+# rather than being pickled with every task.
+_worker_model = None
+_worker_X = None
+_thread_limits = None
+
+
+def _init_impact_worker(impact_model, X: pd.DataFrame, threads: int):
+    global _worker_model, _worker_X, _thread_limits
+
+    for env_var in [
+        "OMP_NUM_THREADS",
+        "OPENBLAS_NUM_THREADS",
+        "MKL_NUM_THREADS",
+        "VECLIB_MAXIMUM_THREADS",
+    ]:
+        os.environ[env_var] = str(threads)
+
+    _thread_limits = threadpool_limits(limits=threads)
+
+    _worker_model = impact_model
+    _worker_X = X
+
+
+def _estimator_impact(ii: int) -> pd.DataFrame:
+    return _worker_model._estimator_impact(
+        _worker_X, _worker_model._ensembled_estimators[ii], ii
+    )
+
+
+def _fitted_estimator_impact(ii: int, estimator) -> pd.DataFrame:
+    # For estimators fit after the worker started, which its copy of
+    # the model doesn't have.
+    return _worker_model._estimator_impact(_worker_X, estimator, ii)
+
+
+class ParallelXGBoostImpactModel(XGBoostImpactModel):
+    """
+    An :py:class:`XGBoostImpactModel` that fits its ensemble and
+    computes its impacts with several workers.
+
+    The training samples are drawn from the random generator in the
+    same order as the serial model draws them, and the impacts of
+    each estimator are reassembled in estimator order, so the results
+    are identical to those of a serial model with the same seed.
+
+    Estimators are fit in threads, since xgboost releases the GIL.
+    Impacts are computed in processes, since SHAP does not.
+
+    Parameters
+    ----------
+    workers
+        How many estimators to fit or explain at once.
+    threads
+        A cap on the total threads used by all of the workers. If
+        `None`, use all of the cores.
+    kwargs
+        Passed on to :py:class:`XGBoostImpactModel`.
+    """
+
+    def __init__(self, *, workers: int = 1, threads: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+
+        self.set_workers(workers, threads)
+
+    def set_workers(self, workers: int, threads: Optional[int] = None):
+        """
+        Change how many workers and threads the model uses, e.g. after
+        loading it from a cache where it was saved with others.
+        """
+        self._workers = workers
+        self._threads_per_worker = worker_threads(workers, threads)
+
+        for estimator in self._ensembled_estimators:
+            estimator.set_params(n_jobs=self._threads_per_worker)
+
+    def _fit_estimators(
+        self,
+        indices: Iterable[int],
+        X: pd.DataFrame,
+        y: pd.Series,
+        sample_weight: Optional[pd.Series] = None,
+    ):
+        """Fit some of the estimators, drawing their samples in order."""
+        estimators = [self._ensembled_estimators[ii] for ii in indices]
+
+        # Draw every sample up front, in order, so that each estimator
+        # gets the same sample it would have in the serial loop.
+        samples = [self._training_sample(X, y, sample_weight) for _ in estimators]
+
+        def fit_one(estimator, sample):
+            X_sample, y_sample, sample_weight_sample = sample
+            if sample_weight is None:
+                estimator.fit(X_sample, y_sample)
+            else:
+                estimator.fit(X_sample, y_sample, sample_weight=sample_weight_sample)
+
+        logger.info(
+            f"Fitting {len(samples)} estimators with {self._workers} workers "
+            f"of {self._threads_per_worker} threads."
+        )
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            # Consume the results so that any exception is raised here.
+            list(executor.map(fit_one, estimators, samples))
+
+    def fit(
+        self, X: pd.DataFrame, y: pd.Series, sample_weight: Optional[pd.Series] = None
+    ):
+        self._fit_estimators(
+            range(len(self._ensembled_estimators)), X, y, sample_weight
+        )
+
+        self._X_fit = X
+
+    def update(
+        self,
+        X: pd.DataFrame,
+        y: pd.Series,
+        sample_weight: Optional[pd.Series] = None,
+        *,
+        rows: pd.Series,
+        rounds: int,
+    ):
+        """
+        Continue boosting every estimator on some of the rows, rather than refitting.
+
+        This is for data that has had rows appended since the model
+        was fit, e.g. a new year. Each estimator gets `rounds` more
+        trees, fit to a sample of the rows where `rows` is true, drawn
+        the same way as the samples it was originally fit to. Impacts
+        are computed again for `X`.
+        """
+        X_rows = X[rows]
+        y_rows = y[rows]
+        sample_weight_rows = None if sample_weight is None else sample_weight[rows]
+
+        samples = [
+            self._training_sample(X_rows, y_rows, sample_weight_rows)
+            for _ in self._ensembled_estimators
+        ]
+
+        def update_one(estimator, sample):
+            X_sample, y_sample, sample_weight_sample = sample
+            booster = estimator.get_booster()
+            estimator.set_params(n_estimators=rounds)
+            estimator.fit(
+                X_sample,
+                y_sample,
+                sample_weight=sample_weight_sample,
+                xgb_model=booster,
+            )
+
+        logger.info(
+            f"Adding {rounds} rounds to {len(samples)} estimators on "
+            f"{len(X_rows.index)} rows with {self._workers} workers."
+        )
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            list(executor.map(update_one, self._ensembled_estimators, samples))
+
+        self._X_fit = X
+        self._df_impact = None
+
+    def _impact_executor(self, X: pd.DataFrame) -> ProcessPoolExecutor:
+        # Spawn rather than fork, since forking after xgboost and
+        # OpenMP have started threads can deadlock.
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_impact_worker,
+            initargs=(self, X, self._threads_per_worker),
+        )
+
+    def _set_impact(self, X: pd.DataFrame, impacts: List[pd.DataFrame]):
+        df_impact = pd.concat(impacts)
+
+        df_impact = df_impact.reset_index(names="X_index")
+        self._df_impact = df_impact[["estimator", "X_index"] + list(X.columns)]
+
+    def impact(self, X: pd.DataFrame) -> pd.DataFrame:
+        if self._df_impact is not None:
+            return self._df_impact
+
+        if self._workers <= 1:
+            return super().impact(X)
+
+        logger.info(
+            f"Computing impacts of {len(self._ensembled_estimators)} estimators "
+            f"with {self._workers} workers."
+        )
+
+        with self._impact_executor(X) as executor:
+            impacts: List[pd.DataFrame] = list(
+                executor.map(_estimator_impact, range(len(self._ensembled_estimators)))
+            )
+
+        self._set_impact(X, impacts)
+
+        return self._df_impact
+
+
+class AdaptiveXGBoostImpactModel(ParallelXGBoostImpactModel):
+    """
+    A :py:class:`ParallelXGBoostImpactModel` that grows its ensemble
+    until the mean impacts settle.
+
+    The model starts with `k_min` estimators and adds `batch` at a
+    time, up to `k_max`. After each batch, it compares the mean impact
+    of each feature on each row with what it was before the batch.
+    It stops when no mean impact moved by more than `tolerance` times
+    the range of the mean impacts of all of the features, which is
+    the range the impact charts share.
+
+    Since the impacts are needed to decide when to stop, :py:meth:`fit`
+    computes them for the data it is given. Estimators are drawn in the
+    same order as with a fixed ensemble size, so a model that stops at
+    `k` is identical to a fixed model of size `k` with the same seed.
+
+    Parameters
+    ----------
+    k_min
+        The smallest ensemble to consider.
+    k_max
+        The largest ensemble to grow.
+    batch
+        How many estimators to add at a time.
+    tolerance
+        How little the mean impacts must move, relative to their range
+        across all features, for the ensemble to be considered settled.
+    kwargs
+        Passed on to :py:class:`ParallelXGBoostImpactModel`.
+
+    Raises
+    ------
+    ValueError
+        If `k_min`, `k_max` or `batch` is less than 1, since the
+        ensemble would never grow.
+    """
+
+    def __init__(
+        self,
+        *,
+        k_min: int = 10,
+        k_max: int = 50,
+        batch: int = 5,
+        tolerance: float = 0.02,
+        **kwargs,
+    ):
+        for name, value in [("k_min", k_min), ("k_max", k_max), ("batch", batch)]:
+            if value < 1:
+                raise ValueError(f"{name} must be at least 1, not {value}.")
+
+        super().__init__(ensemble_size=k_max, **kwargs)
+
+        self._k_min = min(k_min, k_max)
+        self._batch = batch
+        self._tolerance = tolerance
+
+        # The largest relative change in the mean impacts after each batch.
+        self.changes: List[float] = []
+
+    @staticmethod
+    def _change(mean_impact: np.ndarray, new_mean_impact: np.ndarray) -> float:
+        # Impact charts share a y axis spanning every feature's impacts,
+        # so that is the scale on which a move would be visible.
+        scale = new_mean_impact.max() - new_mean_impact.min()
+        delta = np.abs(new_mean_impact - mean_impact).max()
+
+        if scale <= 0:
+            return 0.0 if delta == 0 else np.inf
+
+        return float(delta / scale)
+
+    def fit(
+        self, X: pd.DataFrame, y: pd.Series, sample_weight: Optional[pd.Series] = None
+    ):
+        features = list(X.columns)
+        k_max = len(self._ensembled_estimators)
+
+        impacts: List[pd.DataFrame] = []
+        impact_sum = np.zeros((len(X.index), len(features)))
+        mean_impact = None
+
+        executor = self._impact_executor(X) if self._workers > 1 else None
+
+        try:
+            k = 0
+
+            while k < k_max:
+                k_next = self._k_min if k == 0 else min(k + self._batch, k_max)
+                indices = range(k, k_next)
+
+                self._fit_estimators(indices, X, y, sample_weight)
+
+                estimators = [self._ensembled_estimators[ii] for ii in indices]
+
+                if executor is not None:
+                    batch_impacts = list(
+                        executor.map(_fitted_estimator_impact, indices, estimators)
+                    )
+                else:
+                    batch_impacts = [
+                        self._estimator_impact(X, estimator, ii)
+                        for ii, estimator in zip(indices, estimators)
+                    ]
+
+                for df_estimator_impact in batch_impacts:
+                    impact_sum += df_estimator_impact[features].to_numpy()
+
+                impacts.extend(batch_impacts)
+                k = k_next
+
+                new_mean_impact = impact_sum / k
+
+                if mean_impact is not None:
+                    change = self._change(mean_impact, new_mean_impact)
+                    self.changes.append(change)
+
+                    logger.info(
+                        f"Mean impacts moved by up to {change:.2%} of their range "
+                        f"with {k} estimators."
+                    )
+
+                    if change <= self._tolerance:
+                        break
+
+                mean_impact = new_mean_impact
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        logger.info(f"Using {k} of up to {k_max} estimators.")
+
+        self._ensembled_estimators = self._ensembled_estimators[:k]
+        self._ensemble_size = k
+
+        self._set_impact(X, impacts)
+        self._X_fit = X
@@ -0,0 +1,255 @@
+"""
+A small local stand-in for the Census API.
+
+It answers county name requests from fixture data, optionally with
+added latency and injected failures, so that the concurrency, retry
+and coalescing behavior of :py:mod:`evlcharts.censusapi` can be tried
+out and benchmarked without network access. It also reports how many
+requests it has seen and the most it had in flight at once at
+`/stats`.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+# Fixture data used when no names file is given.
+FIXTURE_NAMES = {
+    "04013": "Maricopa County, Arizona",
+    "06037": "Los Angeles County, California",
+    "06059": "Orange County, California",
+    "13089": "DeKalb County, Georgia",
+    "13121": "Fulton County, Georgia",
+    "17031": "Cook County, Illinois",
+    "48201": "Harris County, Texas",
+}
+
+_ACS5_PATH = re.compile(r"^/data/(\d{4})/acs/acs5$")
+
+
+class FakeCensus:
+    """
+    The state of a fake Census API server.
+
+    Parameters
+    ----------
+    names
+        A dictionary from SSCCC to county name.
+    latency
+        Seconds to wait before answering each request.
+    fail_every
+        If not `None`, answer every `fail_every`-th request with
+        `fail_status`, as the real API does when it is overloaded.
+    fail_status
+        The HTTP status of injected failures, e.g. 503 or 429.
+    retry_after
+        If not `None`, the seconds to send in a `Retry-After` header
+        with each injected failure.
+    """
+
+    def __init__(
+        self,
+        names: Dict[str, str],
+        *,
+        latency: float = 0.0,
+        fail_every: Optional[int] = None,
+        fail_status: int = 503,
+        retry_after: Optional[int] = None,
+    ):
+        self.names = names
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "max_in_flight": self.max_in_flight,
+            }
+
+    def county_rows(self, query: Dict[str, str]):
+        """The rows of a response, or `None` if the query is not one we answer."""
+        if query.get("get") != "NAME":
+            return None
+
+        for_geo = query.get("for", "")
+        in_geo = query.get("in", "")
+
+        if not for_geo.startswith("county:") or not in_geo.startswith("state:"):
+            return None
+
+        county = for_geo.removeprefix("county:")
+        state = in_geo.removeprefix("state:")
+
+        return [["NAME", "state", "county"]] + [
+            [name, fips[:2], fips[2:]]
+            for fips, name in sorted(self.names.items())
+            if fips[:2] == state and county in ("*", fips[2:])
+        ]
+
+
+def _handler(census: FakeCensus):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(
+            self, status: int, body, headers: Optional[Dict[str, str]] = None
+        ):
+            payload = json.dumps(body).encode()
+
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+
+            if url.path == "/stats":
+                self._send_json(200, census.stats())
+                return
+
+            with census._lock:
+                census.requests += 1
+                request_number = census.requests
+                census.in_flight += 1
+                census.max_in_flight = max(census.max_in_flight, census.in_flight)
+
+            try:
+                time.sleep(census.latency)
+
+                if census.fail_every and request_number % census.fail_every == 0:
+                    with census._lock:
+                        census.failures += 1
+                    headers = {}
+                    if census.retry_after is not None:
+                        headers["Retry-After"] = str(census.retry_after)
+                    self._send_json(
+                        census.fail_status, {"error": "Try again later."}, headers
+                    )
+                    return
+
+                rows = None
+                if _ACS5_PATH.match(url.path):
+                    query = dict(urllib.parse.parse_qsl(url.query))
+                    rows = census.county_rows(query)
+
+                if rows is None:
+                    self._send_json(400, {"error": f"Unsupported query {self.path}"})
+                else:
+                    self._send_json(200, rows)
+            finally:
+                with census._lock:
+                    census.in_flight -= 1
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(
+    census: FakeCensus, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """
+    Start a server in a background thread.
+
+    With the default port of 0 the OS picks a free port. The API root to
+    give to :py:class:`evlcharts.censusapi.CensusClient` is then
+    `f"http://{host}:{server.server_port}/data"`.
+    """
+    server = ThreadingHTTPServer((host, port), _handler(census))
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--names",
+        type=str,
+        help="County names file (from countynames.py) to serve. "
+        "Defaults to a few built in counties.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds of added latency."
+    )
+    parser.add_argument(
+        "--fail-every",
+        type=int,
+        help="Answer every this many requests with --fail-status.",
+    )
+    parser.add_argument(
+        "--fail-status",
+        type=int,
+        default=503,
+        help="HTTP status of --fail-every failures, e.g. 503 or 429.",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        help="Seconds to send in a Retry-After header with each failure.",
+    )
+
+    args = parser.parse_args()
+
+    if args.names is not None:
+        # Only the names files need pandas.
+        from evlcharts.names import read_names_file
+
+        names = read_names_file(Path(args.names))
+    else:
+        names = FIXTURE_NAMES
+
+    census = FakeCensus(
+        names,
+        latency=args.latency,
+        fail_every=args.fail_every,
+        fail_status=args.fail_status,
+        retry_after=args.retry_after,
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), _handler(census))
+    server.daemon_threads = True
+
+    logger.info(
+        f"Serving {len(names)} county names at http://{args.host}:{server.server_port}/data"
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Stats: {census.stats()}")
+
+
+if __name__ == "__main__":
+    main()
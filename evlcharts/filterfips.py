@@ -1,13 +1,149 @@
+import json
 import logging
 from pathlib import Path
-
-import pandas as pd
+from typing import Any, Dict, Optional
 
 from evlcharts.loggingargparser import LoggingArgumentParser
 
+# Note that pandas and the loader are imported lazily, only when
+# the counts have to be computed. This runs every time make parses
+# the Makefile, so when the cache is warm we want to answer without
+# paying for those imports.
+
 logger = logging.getLogger(__name__)
 
 
+Y_COLUMNS = ["filing_rate", "threatened_rate", "judgement_rate"]
+
+
+def default_cache_path(input_path: Path) -> Path:
+    """The sidecar cache file that goes next to the input."""
+    return input_path.with_name(f"{input_path.name}.counts.json")
+
+
+def fingerprint(input_path: Path) -> Dict[str, int]:
+    """
+    A cheap fingerprint of an input file or dataset directory.
+
+    We use sizes and modification times rather than a hash of the
+    contents, since hashing hundreds of MB every time make parses
+    the Makefile would defeat the purpose of the cache.
+    """
+    if input_path.is_dir():
+        stats = [p.stat() for p in input_path.rglob("*") if p.is_file()]
+    else:
+        stats = [input_path.stat()]
+
+    return {
+        "files": len(stats),
+        "size": sum(stat.st_size for stat in stats),
+        "mtime_ns": max((stat.st_mtime_ns for stat in stats), default=0),
+    }
+
+
+def county_counts(df) -> Dict[str, Dict[str, int]]:
+    """
+    Count the non-null values of each y column in each county.
+
+    This is done with a single group by, regardless of how many
+    counties there are.
+
+    Returns
+    -------
+        A dictionary from SSCCC to a dictionary from y column to count.
+    """
+    y_cols = [col for col in Y_COLUMNS if col in df.columns]
+
+    df_counts = df.groupby(["STATE", "COUNTY"])[y_cols].count()
+
+    return {
+        f"{state}{county}": {col: int(count) for col, count in row.items()}
+        for (state, county), row in df_counts.iterrows()
+    }
+
+
+def add_counts(
+    total: Dict[str, Dict[str, int]], counts: Dict[str, Dict[str, int]]
+) -> Dict[str, Dict[str, int]]:
+    """Add the counts of one chunk of data to a running total, in place."""
+    for fips, county_counts in counts.items():
+        total_counts = total.setdefault(fips, {})
+        for col, count in county_counts.items():
+            total_counts[col] = total_counts.get(col, 0) + count
+
+    return total
+
+
+def read_cache(
+    cache_path: Path, input_path: Path
+) -> Optional[Dict[str, Dict[str, int]]]:
+    """Read the cached counts, if they are present and up to date."""
+    if not cache_path.exists():
+        return None
+
+    with open(cache_path) as f:
+        cache = json.load(f)
+
+    if cache.get("fingerprint") != fingerprint(input_path):
+        logger.info(f"Cache `{cache_path}` is out of date.")
+        return None
+
+    return cache["counts"]
+
+
+def write_cache(cache_path: Path, input_path: Path, counts: Dict[str, Dict[str, int]]):
+    """Write counts to the cache, keyed by the input's fingerprint."""
+    cache: Dict[str, Any] = {
+        "input": str(input_path),
+        "fingerprint": fingerprint(input_path),
+        "counts": counts,
+    }
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        logger.warning(f"Unable to write cache `{cache_path}`: {e}")
+
+
+def load_counts(
+    input_path: Path,
+    cache_path: Optional[Path] = None,
+    chunksize: Optional[int] = None,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Get the counts from the cache or, if necessary, from the input.
+
+    If `chunksize` is given, the input is read that many rows at a
+    time, so memory use does not grow with the size of the input.
+    """
+    if cache_path is None:
+        cache_path = default_cache_path(input_path)
+
+    counts = read_cache(cache_path, input_path)
+
+    if counts is None:
+        import evlcharts.loader as loader
+
+        columns = ["STATE", "COUNTY"] + Y_COLUMNS
+
+        if chunksize is None:
+            counts = county_counts(loader.read_data(input_path, columns=columns))
+        else:
+            counts = {}
+            for df in loader.read_chunks(
+                input_path, chunksize=chunksize, columns=columns
+            ):
+                add_counts(counts, county_counts(df))
+
+        write_cache(cache_path, input_path, counts)
+    else:
+        logger.info(f"Using cached counts from `{cache_path}`")
+
+    return counts
+
+
 def main():
     parser = LoggingArgumentParser(logger)
 
@@ -17,7 +153,7 @@ def main():
         "-y",
         "--y-column",
         type=str,
-        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        choices=Y_COLUMNS,
         default="filing_rate",
         help="What variable are we trying to predict?",
     )
@@ -32,29 +168,31 @@ def main():
         help="Provide this as SSCCC for the state and county.",
     )
 
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Cache file for per-county counts. Defaults to a file next to the input.",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="If the counts have to be computed, read the input this many rows at a time.",
+    )
+
     args = parser.parse_args()
 
     input_path = Path(args.input)
+    cache_path = Path(args.cache) if args.cache is not None else None
 
-    logger.info(f"Reading input file `{input_path}`")
-
-    df = pd.read_csv(
-        input_path, header=0, dtype={"STATE": str, "COUNTY": str, "TRACT": str}
-    )
+    counts = load_counts(input_path, cache_path, args.chunksize)
 
     good_fips = []
 
     for fips in args.fips:
-        state = fips[:2]
-        county = fips[2:]
-
-        df_county = df[
-            (df["STATE"] == state)
-            & (df["COUNTY"] == county)
-            & ~df[args.y_column].isna()
-        ]
+        count = counts.get(fips, {}).get(args.y_column, 0)
 
-        if len(df_county.index) < args.threshold:
+        if count < args.threshold:
             logger.info(f"Less than {args.threshold} rows for county fips {fips}")
         else:
             good_fips.append(fips)
@@ -0,0 +1,171 @@
+"""An on-disk cache of tract geometry, shared by all the years with the same boundaries."""
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import censusdis.data as ced
+import geopandas as gpd
+from censusdis.datasets import ACS5, DECENNIAL_PUBLIC_LAW_94_171
+
+logger = logging.getLogger(__name__)
+
+
+ALTERNATE_MAP_YEARS = {
+    # 2009: 2010,
+}
+
+"""
+A map for years for which there are not CB shapefiles available to the alternate years to get them for.
+"""
+
+ALTERNATE_DATA_SET = {2000: DECENNIAL_PUBLIC_LAW_94_171}
+
+EPOCH_MAP_YEARS = {
+    2000: 2009,
+    2010: 2018,
+}
+
+"""
+The year whose shapefiles we use for all the years in a boundary epoch.
+Tract boundaries only change with each decennial census, so we fetch
+one set of shapes per epoch. Epochs that are not listed use the shapes
+of the epoch year itself.
+"""
+
+
+def boundary_epoch(year: int) -> int:
+    """
+    The decennial census whose tract boundaries are used in a year.
+
+    ACS 5-year data up to 2009 uses 2000 tracts, from 2010 through
+    2019 it uses 2010 tracts and so on.
+    """
+    map_year = ALTERNATE_MAP_YEARS.get(year, year)
+    return (map_year // 10) * 10
+
+
+def epoch_map_year(epoch: int) -> int:
+    return EPOCH_MAP_YEARS.get(epoch, epoch)
+
+
+def download_tracts(
+    state: str, county: str, epoch: int, api_key: Optional[str] = None
+) -> gpd.GeoDataFrame:
+    """Download the tract geometry of a county, or of every county if `county` is `"*"`."""
+    map_year = epoch_map_year(epoch)
+    dataset = ALTERNATE_DATA_SET.get(map_year, ACS5)
+
+    logger.info(
+        f"Downloading tracts for {state}{county} in the {epoch} epoch from {map_year}."
+    )
+
+    return ced.download(
+        dataset=dataset,
+        vintage=map_year,
+        download_variables=["NAME"],
+        state=state,
+        county=county,
+        tract="*",
+        with_geometry=True,
+        api_key=api_key,
+    )
+
+
+class TractGeometryCache:
+    """
+    A directory of GeoParquet files of tract geometry, one per
+    county and boundary epoch.
+
+    Every year in an epoch shares the same file, so mapping ten
+    years of a county costs at most one or two downloads, and none
+    at all once the cache is warm.
+    """
+
+    def __init__(self, path: Optional[Path], *, api_key: Optional[str] = None):
+        self._path = Path(path) if path is not None else None
+        self._api_key = api_key
+
+        # Shapes we have already loaded, so years in the same epoch
+        # don't read the file again.
+        self._loaded: Dict[Tuple[str, str, int], gpd.GeoDataFrame] = {}
+
+    def _county_path(self, state: str, county: str, epoch: int) -> Path:
+        return self._path / str(epoch) / f"{state}{county}.parquet"
+
+    def _save(self, gdf: gpd.GeoDataFrame, state: str, county: str, epoch: int):
+        if self._path is None:
+            return
+
+        county_path = self._county_path(state, county, epoch)
+        county_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file and rename so that concurrent
+        # readers never see a partial file.
+        tmp_path = county_path.with_suffix(f".{os.getpid()}.tmp")
+        gdf.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, county_path)
+
+    def _read(self, state: str, county: str, epoch: int) -> Optional[gpd.GeoDataFrame]:
+        if self._path is None:
+            return None
+
+        county_path = self._county_path(state, county, epoch)
+
+        if not county_path.exists():
+            return None
+
+        logger.info(f"Reading tracts from `{county_path}`")
+
+        return gpd.read_parquet(county_path)
+
+    def county_tracts(self, state: str, county: str, year: int) -> gpd.GeoDataFrame:
+        """The tracts of a county, as they were in `year`."""
+        epoch = boundary_epoch(year)
+        key = (state, county, epoch)
+
+        if key not in self._loaded:
+            gdf = self._read(state, county, epoch)
+
+            if gdf is None:
+                gdf = download_tracts(state, county, epoch, self._api_key)
+                self._save(gdf, state, county, epoch)
+
+            self._loaded[key] = gdf
+
+        return self._loaded[key]
+
+    def state_tracts(
+        self, state: str, counties: Iterable[str], year: int
+    ) -> Dict[str, gpd.GeoDataFrame]:
+        """
+        The tracts of several counties in a state, as they were in `year`.
+
+        Counties that are not in the cache are fetched with a single
+        download for the whole state, which is split up by county in
+        memory and cached county by county.
+        """
+        epoch = boundary_epoch(year)
+        counties = list(counties)
+
+        missing = []
+
+        for county in counties:
+            key = (state, county, epoch)
+            if key not in self._loaded:
+                gdf = self._read(state, county, epoch)
+                if gdf is None:
+                    missing.append(county)
+                else:
+                    self._loaded[key] = gdf
+
+        if missing:
+            gdf_state = download_tracts(state, "*", epoch, self._api_key)
+
+            for county in missing:
+                gdf = gdf_state[gdf_state["COUNTY"] == county].reset_index(drop=True)
+                self._save(gdf, state, county, epoch)
+                self._loaded[(state, county, epoch)] = gdf
+
+        return {county: self._loaded[(state, county, epoch)] for county in counties}
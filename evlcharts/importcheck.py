@@ -0,0 +1,174 @@
+"""
+Check that commands import quickly.
+
+Each module is imported in a fresh interpreter with `-X importtime`.
+A module fails if its cumulative import time is over its budget or if
+it pulls in any of the heavy packages it is meant to avoid. Light
+commands run often, e.g. filterfips every time make parses the
+Makefile, so a stray top level import of pandas or censusdis in a
+shared module is easy to add and costly to miss.
+"""
+
+import csv
+import logging
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+HEAVY_PACKAGES = [
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "sklearn",
+    "xgboost",
+    "shap",
+    "impactchart",
+    "matplotlib",
+    "geopandas",
+    "censusdis",
+]
+
+# Seconds each module may take to import and packages it must not
+# import. The budgets leave room for slower machines; the package
+# lists are what catch regressions reliably.
+IMPORT_BUDGETS: Dict[str, Tuple[float, List[str]]] = {
+    "evlcharts.cli": (0.05, HEAVY_PACKAGES),
+    "evlcharts.client": (0.1, HEAVY_PACKAGES),
+    "evlcharts.filterfips": (0.1, HEAVY_PACKAGES),
+    "evlcharts.checksite": (0.1, HEAVY_PACKAGES),
+    "evlcharts.fakecensus": (0.1, HEAVY_PACKAGES),
+    "evlcharts.censusapi": (0.1, HEAVY_PACKAGES),
+    "evlcharts.variables": (1.0, ["censusdis", "xgboost", "matplotlib"]),
+    "evlcharts.topscore": (1.0, ["censusdis", "xgboost", "matplotlib"]),
+    "evlcharts.countynames": (1.0, ["censusdis", "xgboost", "matplotlib"]),
+    "evlcharts.rankbuckets": (1.0, ["censusdis", "xgboost", "matplotlib"]),
+    "evlcharts.rendersite": (1.0, ["censusdis", "xgboost", "matplotlib"]),
+    "evlcharts.select": (1.5, ["censusdis", "xgboost", "matplotlib"]),
+}
+
+
+def import_times(module: str) -> Dict[str, float]:
+    """
+    Import a module in a fresh interpreter.
+
+    Returns
+    -------
+        The cumulative import time in seconds of every module that
+        was imported, by name.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+
+    for line in completed.stderr.splitlines():
+        # Lines look like "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+
+    return times
+
+
+def check_module(
+    module: str, forbidden: List[str], repeat: int
+) -> Tuple[float, List[str]]:
+    """
+    Time a module's import and find any forbidden packages it imports.
+
+    The time is the best of `repeat` imports, to keep noise from other
+    processes out of it.
+    """
+    best = None
+
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module] < best:
+            best = times[module]
+
+    heavy = sorted(
+        package
+        for package in forbidden
+        if any(name == package or name.startswith(f"{package}.") for name in times)
+    )
+
+    return best, heavy
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Imports to time for each module."
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget by this, e.g. on slow machines.",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, help="CSV file to write the times to."
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        help="Modules to check. Defaults to all of the modules with budgets.",
+    )
+
+    args = parser.parse_args()
+
+    modules = args.modules if args.modules else list(IMPORT_BUDGETS)
+
+    rows = []
+    failed = False
+
+    for module in modules:
+        budget, forbidden = IMPORT_BUDGETS.get(module, (float("inf"), []))
+        budget *= args.scale
+
+        seconds, heavy = check_module(module, forbidden, args.repeat)
+
+        rows.append(
+            {
+                "module": module,
+                "seconds": seconds,
+                "budget": budget,
+                "heavy": " ".join(heavy),
+            }
+        )
+
+        if seconds > budget:
+            logger.error(f"{module} took {seconds:.3f}s to import; budget {budget}s.")
+        if heavy:
+            logger.error(f"{module} imports {', '.join(heavy)}.")
+        if seconds <= budget and not heavy:
+            logger.info(f"{module} took {seconds:.3f}s to import.")
+
+        failed = failed or seconds > budget or bool(heavy)
+
+    if args.output is not None:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["module", "seconds", "budget", "heavy"]
+            )
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Read and write the joined and county data in CSV or columnar formats."""
+
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+# Identifier columns that must be read as strings so that leading
+# zeros in FIPS codes are preserved.
+ID_DTYPES = {"STATE": str, "COUNTY": str, "TRACT": str}
+
+# Columns that columnar datasets are partitioned on.
+PARTITION_COLUMNS = ["STATE", "COUNTY"]
+
+_PARTITIONING = ds.partitioning(
+    pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor="hive"
+)
+
+# Map from file or dataset directory suffixes to formats.
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".feather": "ipc",
+    ".arrow": "ipc",
+}
+
+
+def data_format(path: Path) -> str:
+    """The format of a data file or dataset directory, based on its suffix."""
+    try:
+        return FORMATS[Path(path).suffix]
+    except KeyError:
+        raise ValueError(
+            f"Unknown data format for `{path}`; expected one of {', '.join(FORMATS)}."
+        )
+
+
+def county_data_path(data_path: Path, fips: str) -> Path:
+    """
+    Where to read a county's data from when processing many counties.
+
+    `data_path` is either a directory of county files from select.py
+    or a file or dataset that contains many counties.
+    """
+    if data_path.is_dir() and data_path.suffix not in FORMATS:
+        for suffix in FORMATS:
+            county_path = data_path / f"{fips}{suffix}"
+            if county_path.exists():
+                return county_path
+
+        raise FileNotFoundError(f"No data file for {fips} in `{data_path}`.")
+
+    return data_path
+
+
+def _dataset(path: Path, fmt: str, memory_map: bool = True) -> ds.Dataset:
+    return ds.dataset(
+        path,
+        format=fmt,
+        partitioning=_PARTITIONING if path.is_dir() else None,
+        filesystem=pafs.LocalFileSystem(use_mmap=memory_map),
+    )
+
+
+def read_schema(path: Path) -> pd.DataFrame:
+    """
+    An empty data frame with the columns of the data at `path`.
+
+    This is enough to decide which columns to read, for example with
+    :py:func:`evlcharts.variables.x_cols`, without reading any rows.
+    """
+    path = Path(path)
+    fmt = data_format(path)
+
+    if fmt == "csv":
+        return pd.read_csv(path, header=0, dtype=ID_DTYPES, nrows=0)
+
+    return _dataset(path, fmt).schema.empty_table().to_pandas()
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Use the smallest dtypes that hold the data exactly.
+
+    Identifier columns become categorical, integer columns are
+    downcast, and float columns become float32 only if every value
+    survives the round trip, so nothing computed from the data
+    changes.
+    """
+    compacted = {}
+
+    for col in df.columns:
+        series = df[col]
+
+        if col in ID_DTYPES:
+            compacted[col] = series.astype("category")
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            compacted[col] = pd.to_numeric(series, downcast="integer")
+        elif series.dtype == np.float64:
+            series32 = series.astype(np.float32)
+            if np.array_equal(
+                series32.to_numpy(np.float64), series.to_numpy(), equal_nan=True
+            ):
+                compacted[col] = series32
+            else:
+                compacted[col] = series
+        else:
+            compacted[col] = series
+
+    return pd.DataFrame(compacted, index=df.index)
+
+
+def _megabytes(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1_000_000
+
+
+def read_data(
+    path: Path,
+    *,
+    columns: Optional[Iterable[str]] = None,
+    fips: Optional[str] = None,
+    memory_map: bool = True,
+) -> pd.DataFrame:
+    """
+    Read joined or county data.
+
+    Parameters
+    ----------
+    path
+        A CSV file, a Parquet or Arrow IPC file, or a directory
+        containing a STATE/COUNTY partitioned dataset as written
+        by :py:func:`write_dataset`.
+    columns
+        If not `None`, only read these columns.
+    fips
+        If not `None`, only read the rows for this SSCCC county.
+        For partitioned datasets, only the matching partition is read.
+    memory_map
+        Memory map columnar files rather than reading them into
+        buffers.
+
+    Returns
+    -------
+        The data.
+    """
+    path = Path(path)
+    fmt = data_format(path)
+
+    if columns is not None:
+        columns = list(columns)
+
+    logger.info(f"Reading {fmt} data from `{path}`")
+
+    if fmt == "csv":
+        # We need the partition columns to pick out the county even
+        # if the caller doesn't want them.
+        extra_columns: List[str] = []
+        if columns is not None and fips is not None:
+            extra_columns = [col for col in PARTITION_COLUMNS if col not in columns]
+
+        df = pd.read_csv(
+            path,
+            header=0,
+            dtype=ID_DTYPES,
+            usecols=None if columns is None else columns + extra_columns,
+        )
+
+        if fips is not None:
+            df = df[(df["STATE"] == fips[:2]) & (df["COUNTY"] == fips[2:])]
+
+        df = df.drop(columns=extra_columns)
+    else:
+        dataset = _dataset(path, fmt, memory_map)
+
+        if fips is not None:
+            row_filter = (ds.field("STATE") == fips[:2]) & (
+                ds.field("COUNTY") == fips[2:]
+            )
+        else:
+            row_filter = None
+
+        table = dataset.to_table(columns=columns, filter=row_filter)
+
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+
+    return df
+
+
+def read_chunks(
+    path: Path,
+    *,
+    chunksize: int,
+    columns: Optional[Iterable[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Read data a chunk of at most `chunksize` rows at a time, so that
+    memory use is bounded by the chunk size rather than the size of
+    the data.
+    """
+    path = Path(path)
+    fmt = data_format(path)
+
+    if columns is not None:
+        columns = list(columns)
+
+    logger.info(f"Reading {fmt} data from `{path}` in chunks of {chunksize:,} rows")
+
+    if fmt == "csv":
+        with pd.read_csv(
+            path, header=0, dtype=ID_DTYPES, usecols=columns, chunksize=chunksize
+        ) as reader:
+            yield from reader
+    else:
+        for batch in _dataset(path, fmt).to_batches(
+            columns=columns, batch_size=chunksize
+        ):
+            yield batch.to_pandas()
+
+
+def read_columns(
+    path: Path,
+    columns: Iterable[str],
+    *,
+    fips: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Read only the `columns` a step needs, in compact dtypes.
+
+    Logs how much memory that saves compared to reading every
+    column with the default dtypes. See :py:func:`compact_dtypes`.
+    """
+    columns = list(dict.fromkeys(columns))
+
+    df_schema = read_schema(path)
+
+    df = read_data(path, columns=columns, fips=fips)
+
+    megabytes = _megabytes(df)
+    compact_df = compact_dtypes(df)
+    compact_megabytes = _megabytes(compact_df)
+
+    # Estimate the columns we didn't read from the ones we did.
+    full_megabytes = megabytes * len(df_schema.columns) / max(len(columns), 1)
+
+    logger.info(
+        f"Read {len(columns)} of {len(df_schema.columns)} columns in "
+        f"{compact_megabytes:.2f} MB rather than about {full_megabytes:.2f} MB, "
+        f"saving about {full_megabytes - compact_megabytes:.2f} MB."
+    )
+
+    return compact_df
+
+
+def _default_dtype(dtype: np.dtype) -> np.dtype:
+    """The dtype pandas would have read a compacted numeric column with."""
+    if dtype.kind == "f":
+        return np.dtype(np.float64)
+    if dtype.kind in "iu":
+        return np.dtype(np.int64)
+    return dtype
+
+
+def data_hash(X: pd.DataFrame, y: pd.Series, w: Optional[pd.Series] = None) -> str:
+    """
+    A hash of the data a county's models are fit on, for caching.
+
+    Numeric values are hashed in the default dtypes, so data read in
+    compact dtypes hashes the same as when it is read with the defaults.
+    """
+    h = hashlib.sha256()
+
+    h.update(",".join(X.columns).encode())
+    X = X.astype({col: _default_dtype(dtype) for col, dtype in X.dtypes.items()})
+    h.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    y = y.astype(_default_dtype(y.dtype))
+    h.update(pd.util.hash_pandas_object(y, index=False).to_numpy().tobytes())
+    if w is not None:
+        w = w.astype(_default_dtype(w.dtype))
+        h.update(pd.util.hash_pandas_object(w, index=False).to_numpy().tobytes())
+
+    return h.hexdigest()
+
+
+def write_data(df: pd.DataFrame, path: Path):
+    """Write a single data file in the format implied by its suffix."""
+    path = Path(path)
+    fmt = data_format(path)
+
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(path)
+
+
+def write_dataset(df: pd.DataFrame, path: Path):
+    """
+    Write data to a STATE/COUNTY partitioned dataset.
+
+    Partitions for counties that are in `df` replace any that
+    already exist in the dataset. Others are left alone.
+    """
+    path = Path(path)
+    fmt = data_format(path)
+
+    if fmt == "csv":
+        raise ValueError(f"Cannot write a partitioned dataset as CSV to `{path}`.")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    ds.write_dataset(
+        table,
+        path,
+        format=fmt,
+        partitioning=_PARTITIONING,
+        existing_data_behavior="delete_matching",
+    )
+
+
+class ChunkWriter:
+    """
+    Write a data file a chunk at a time, in the format implied by its suffix.
+
+    CSV files get a single header. Parquet and Arrow IPC files take
+    their schema from the first chunk, with integer columns widened
+    to float64, since a later chunk may have missing values in them.
+    """
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._fmt = data_format(self._path)
+        self._writer = None
+        self._schema = None
+        self._started = False
+
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame):
+        if self._fmt == "csv":
+            df.to_csv(
+                self._path,
+                mode="a" if self._started else "w",
+                header=not self._started,
+                index=False,
+            )
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+
+            if self._schema is None:
+                self._schema = pa.schema(
+                    [
+                        pa.field(field.name, pa.float64())
+                        if pa.types.is_integer(field.type)
+                        else field
+                        for field in table.schema
+                    ]
+                )
+                if self._fmt == "parquet":
+                    self._writer = pq.ParquetWriter(self._path, self._schema)
+                else:
+                    self._writer = pa.ipc.new_file(str(self._path), self._schema)
+
+            self._writer.write_table(table.cast(self._schema))
+
+        self._started = True
+        self.rows += len(df.index)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
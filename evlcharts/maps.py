@@ -1,36 +1,219 @@
 import logging
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, Iterable, List
 
-import censusdis.data as ced
+import geopandas as gpd
 import matplotlib.pyplot as plt
 import pandas as pd
-from censusdis.datasets import ACS5, DECENNIAL_PUBLIC_LAW_94_171
 
+import evlcharts.loader as loader
+from evlcharts.censusapi import CensusClient, add_api_key_argument
+from evlcharts.geometry import TractGeometryCache, boundary_epoch
 from evlcharts.loggingargparser import LoggingArgumentParser
 
 logger = logging.getLogger(__name__)
 
 
-ALTERNATE_MAP_YEARS = {
-    # 2009: 2010,
-}
+TRACT_KEYS = ["STATE", "COUNTY", "TRACT"]
 
-ALTERNATE_DATA_SET = {2000: DECENNIAL_PUBLIC_LAW_94_171}
 
-"""
-A map for years for which there are not CB shapefiles available to the alternate years to get them for.
-"""
+def plot_coverage_map(
+    gdf_map_year: gpd.GeoDataFrame,
+    gdf_plot: gpd.GeoDataFrame,
+    year: int,
+    output_path: Path,
+):
+    """Plot the tracts of a county, highlighting the ones we have data for."""
+    fig, ax = plt.subplots(figsize=(3, 3))
+
+    ax = gdf_map_year.plot(
+        color="beige",
+        linewidth=0,
+        ax=ax,
+        zorder=1,
+    )
+
+    if len(gdf_plot.index) > 0:
+        ax = gdf_plot.plot(
+            color="seagreen",
+            linewidth=0,
+            ax=ax,
+            zorder=2,
+        )
+
+    ax = gdf_map_year.boundary.plot(
+        color="#333333",
+        linewidth=1,
+        ax=ax,
+        zorder=3,
+    )
+
+    ax.axis("off")
+
+    ax.set_title(
+        f"{year} Data Coverage\n{len(gdf_plot.index)} of {len(gdf_map_year.index)} tracts",
+        fontsize=9,
+    )
+
+    fig.savefig(output_path / f"{year}.png")
+    plt.close(fig)
+
+
+def map_county(
+    df: pd.DataFrame,
+    tracts: Dict[int, gpd.GeoDataFrame],
+    years: Iterable[int],
+    output_path: Path,
+):
+    """
+    Plot the coverage maps of a county for each year.
+
+    Parameters
+    ----------
+    df
+        The county's data, with the tract keys and `year`.
+    tracts
+        The county's tracts, by boundary epoch.
+    years
+        The years to map.
+    output_path
+        The directory to write a map for each year into.
+    """
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # One merge per boundary epoch covers all of its years. Then we
+    # split the covered tracts up by year.
+    covered_by_year = {}
+
+    for epoch, gdf_tracts in tracts.items():
+        gdf_covered = gdf_tracts.merge(df[TRACT_KEYS + ["year"]], on=TRACT_KEYS)
+
+        for year, gdf_year in gdf_covered.groupby("year", sort=False):
+            if boundary_epoch(year) == epoch:
+                covered_by_year[year] = gdf_year
+
+    for year in years:
+        gdf_map_year = tracts[boundary_epoch(year)]
+        gdf_plot = covered_by_year.get(year, gdf_map_year.iloc[:0])
+
+        logger.info(
+            f"Mapping {year}: {len(gdf_plot.index)} of {len(gdf_map_year.index)} tracts "
+            f"with {boundary_epoch(year)} tract boundaries."
+        )
+
+        plot_coverage_map(gdf_map_year, gdf_plot, year, output_path)
+
+
+def map_counties(
+    data_path: Path,
+    fips_list: List[str],
+    y_col: str,
+    years: List[int],
+    output_dir: Path,
+    tract_cache: TractGeometryCache,
+    client: CensusClient,
+    *,
+    workers: int,
+) -> List[str]:
+    """
+    Plot the coverage maps of many counties.
+
+    The geometry of all of the counties in a state is loaded at once,
+    with the downloads for different states made concurrently by
+    `client`, and the maps of each county are plotted in a pool of
+    `workers` processes.
+
+    `data_path` is a directory of county files from select.py or a
+    file or dataset that contains many counties.
+
+    Returns
+    -------
+        The FIPS codes of counties that failed.
+    """
+    counties_by_state = defaultdict(list)
+    for fips in fips_list:
+        counties_by_state[fips[:2]].append(fips[2:])
+
+    epoch_years = {boundary_epoch(year): year for year in years}
+
+    # Load the geometry for each state and epoch concurrently.
+    state_epochs = [
+        (state, epoch) for state in counties_by_state for epoch in epoch_years
+    ]
+
+    state_tracts = client.call_all(
+        (
+            (state, epoch),
+            tract_cache.state_tracts,
+            (state, counties_by_state[state], epoch_years[epoch]),
+        )
+        for state, epoch in state_epochs
+    )
+
+    tracts = defaultdict(dict)
+
+    for (state, epoch), county_tracts in zip(state_epochs, state_tracts):
+        for county, gdf_tracts in county_tracts.items():
+            tracts[f"{state}{county}"][epoch] = gdf_tracts
+
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+
+        for fips in fips_list:
+            try:
+                county_path = loader.county_data_path(data_path, fips)
+            except FileNotFoundError as e:
+                logger.error(e)
+                failed.append(fips)
+                continue
+
+            df = loader.read_columns(
+                county_path, TRACT_KEYS + ["year", y_col], fips=fips
+            )
+
+            future = executor.submit(
+                map_county, df, tracts[fips], years, output_dir / fips
+            )
+            futures[future] = fips
+
+        for future in as_completed(futures):
+            fips = futures[future]
+            try:
+                future.result()
+                logger.info(f"Finished {fips}.")
+            except Exception as e:
+                logger.error(f"Failed to map {fips}: {e}")
+                failed.append(fips)
+
+    return failed
 
 
 def main():
     parser = LoggingArgumentParser(logger)
 
-    parser.add_argument(
+    fips_group = parser.add_mutually_exclusive_group(required=True)
+
+    fips_group.add_argument(
         "--fips",
         type=str,
         help="Provide this as SSCCC for the state and county.",
     )
 
+    fips_group.add_argument(
+        "--fips-list",
+        type=str,
+        nargs="+",
+        help="Map all of these counties in one process pool. "
+        "Then input is a directory of county files or a multi-county "
+        "dataset, and output is a directory with a subdirectory for each county.",
+    )
+
     parser.add_argument("--start", type=int, default=2009, help="Year to start.")
     parser.add_argument("--end", type=int, default=2018, help="Year to end.")
 
@@ -43,6 +226,27 @@ def main():
         help="What variable are we trying to predict?",
     )
 
+    parser.add_argument(
+        "--geometry-cache",
+        type=str,
+        help="Directory to cache tract geometry in, so it is only downloaded once.",
+    )
+
+    add_api_key_argument(parser)
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="The most geometry downloads to have in flight at once.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes for --fips-list. Defaults to the number of cores.",
+    )
+
     parser.add_argument("-o", "--output", required=True, type=str, help="Output file.")
 
     parser.add_argument("input", help="Input file. The output of join.py.")
@@ -52,79 +256,52 @@ def main():
     input_path = Path(args.input)
     output_path = Path(args.output)
 
-    logger.info(f"Reading input file `{input_path}`")
-
-    state = args.fips[:2]
-    county = args.fips[2:]
+    years = list(range(args.start, args.end + 1))
 
-    df = pd.read_csv(
-        input_path, header=0, dtype={"STATE": str, "COUNTY": str, "TRACT": str}
+    tract_cache = TractGeometryCache(
+        Path(args.geometry_cache) if args.geometry_cache is not None else None,
+        api_key=args.census_api_key,
     )
-
-    output_path.mkdir(parents=True, exist_ok=True)
-
-    for year in range(args.start, args.end + 1):
-        map_year = ALTERNATE_MAP_YEARS.get(year, year)
-
-        df_year = df[df["year"] == year]
-
-        logger.info(
-            f"Mapping {year} with {len(df_year.index)} rows with maps from {map_year}."
-        )
-
-        dataset = ALTERNATE_DATA_SET.get(map_year, ACS5)
-
-        gdf_map_year = ced.download(
-            dataset=dataset,
-            vintage=map_year,
-            download_variables=["NAME"],
-            state=state,
-            county=county,
-            tract="*",
-            with_geometry=True,
+    client = CensusClient(concurrency=args.concurrency, api_key=args.census_api_key)
+
+    if args.fips_list is not None:
+        failed = map_counties(
+            input_path,
+            args.fips_list,
+            args.y_column,
+            years,
+            output_path,
+            tract_cache,
+            client,
+            workers=args.workers if args.workers is not None else os.cpu_count() or 1,
         )
 
-        logger.info(f"Total tracts: {len(gdf_map_year.index)}")
+        if failed:
+            logger.warning(f"Counties that failed: {' '.join(sorted(failed))}")
+            sys.exit(1)
 
-        gdf_plot = gdf_map_year.merge(
-            df_year[["STATE", "COUNTY", "TRACT", args.y_column]],
-            on=["STATE", "COUNTY", "TRACT"],
-        )
-
-        logger.info(f"Merged tracts: {len(gdf_plot.index)}")
-
-        fig, ax = plt.subplots(figsize=(3, 3))
+        return
 
-        ax = gdf_map_year.plot(
-            color="beige",
-            linewidth=0,
-            ax=ax,
-            zorder=1,
-        )
-
-        if len(gdf_plot.index) > 0:
-            ax = gdf_plot.plot(
-                color="seagreen",
-                linewidth=0,
-                ax=ax,
-                zorder=2,
-            )
+    state = args.fips[:2]
+    county = args.fips[2:]
 
-        ax = gdf_map_year.boundary.plot(
-            color="#333333",
-            linewidth=1,
-            ax=ax,
-            zorder=3,
-        )
+    df = loader.read_columns(
+        input_path, TRACT_KEYS + ["year", args.y_column], fips=args.fips
+    )
 
-        ax.axis("off")
+    epoch_years = {boundary_epoch(year): year for year in years}
 
-        ax.set_title(
-            f"{year} Data Coverage\n{len(gdf_plot.index)} of {len(gdf_map_year.index)} tracts",
-            fontsize=9,
+    tracts = dict(
+        zip(
+            epoch_years,
+            client.call_all(
+                (epoch, tract_cache.county_tracts, (state, county, year))
+                for epoch, year in epoch_years.items()
+            ),
         )
+    )
 
-        fig.savefig(output_path / f"{year}.png")
+    map_county(df, tracts, years, output_path)
 
 
 if __name__ == "__main__":
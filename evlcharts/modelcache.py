@@ -0,0 +1,113 @@
+"""An on-disk cache of fitted impact models, so charts can be re-rendered without refitting."""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import pandas as pd
+import xgboost
+from impactchart.model import ImpactModel
+
+import evlcharts.loader as loader
+
+logger = logging.getLogger(__name__)
+
+
+def model_key(
+    X: pd.DataFrame,
+    y: pd.Series,
+    w: Optional[pd.Series],
+    xgb_params: Dict[str, Any],
+    k: Union[int, str],
+    seed: int,
+) -> str:
+    """
+    A key for a fitted impact model.
+
+    It covers everything that goes into the fit: the county's
+    data, including its index since impacts are keyed on it, the
+    xgboost params, the ensemble size, or how it is chosen if it is
+    adaptive, and the seed.
+    """
+    h = hashlib.sha256()
+
+    h.update(loader.data_hash(X, y, w).encode())
+    h.update(pd.util.hash_pandas_object(X.index).to_numpy().tobytes())
+    h.update(json.dumps(xgb_params, sort_keys=True, default=str).encode())
+    h.update(f"{k}:{seed}:{xgboost.__version__}".encode())
+
+    return h.hexdigest()
+
+
+class ModelCache:
+    """
+    A directory of pickled, fitted impact models.
+
+    Models are saved after their impacts have been computed, so a
+    model loaded from the cache can produce charts and bucketed
+    impacts without fitting or explaining anything.
+    """
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+
+    def _model_path(self, key: str) -> Path:
+        return self._path / f"{key}.pkl"
+
+    def load(self, key: str) -> Optional[ImpactModel]:
+        model_path = self._model_path(key)
+
+        if not model_path.exists():
+            return None
+
+        logger.info(f"Loading impact model from `{model_path}`")
+
+        with open(model_path, "rb") as f:
+            return pickle.load(f)
+
+    def _latest_path(self, name: str) -> Path:
+        return self._path / f"latest-{name}.json"
+
+    def latest(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        What :py:meth:`set_latest` last recorded for `name`, e.g. a
+        county, or `None`.
+        """
+        latest_path = self._latest_path(name)
+
+        if not latest_path.exists():
+            return None
+
+        with open(latest_path) as f:
+            return json.load(f)
+
+    def set_latest(self, name: str, info: Dict[str, Any]):
+        """
+        Record the latest model saved for `name`, with its `key` and
+        anything else needed to update it incrementally.
+        """
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        latest_path = self._latest_path(name)
+        tmp_path = latest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(info, f, indent=2)
+        os.replace(tmp_path, latest_path)
+
+    def save(self, key: str, impact_model: ImpactModel):
+        model_path = self._model_path(key)
+
+        logger.info(f"Saving impact model to `{model_path}`")
+
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file and rename so that concurrent
+        # readers never see a partial model.
+        tmp_path = model_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(impact_model, f)
+        os.replace(tmp_path, model_path)
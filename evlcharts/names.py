@@ -0,0 +1,138 @@
+"""Look up county names in bulk, with a persistent cache so most lookups are offline."""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+
+from evlcharts.censusapi import CensusClient
+
+logger = logging.getLogger(__name__)
+
+
+def read_names_file(path: Path) -> Dict[str, str]:
+    """Read a FIPS to name file, as written by :py:mod:`evlcharts.countynames`."""
+    df = pd.read_csv(path, header=0, dtype={"FIPS": str})
+
+    return dict(zip(df["FIPS"], df["NAME"]))
+
+
+class CountyNames:
+    """
+    Resolve SSCCC FIPS codes to county names.
+
+    Names are looked up first in `names_files`, then in a JSON cache
+    at `cache_path`. Anything still missing is fetched from the Census
+    API one state at a time, so resolving every county in a state
+    costs a single request, and the results are added to the cache.
+    The states are fetched concurrently.
+
+    Parameters
+    ----------
+    vintage
+        The year of the names to use.
+    cache_path
+        A JSON file that caches names between runs. If `None`, names
+        are only cached in memory.
+    names_files
+        CSV files with `FIPS` and `NAME` columns to use as sources.
+    offline
+        If `True`, never call the Census API. Counties we have no name
+        for are named by their FIPS code.
+    client
+        The client to fetch names with. If `None`, a default one is
+        used.
+    """
+
+    def __init__(
+        self,
+        vintage: int,
+        *,
+        cache_path: Optional[Path] = None,
+        names_files: Iterable[Path] = (),
+        offline: bool = False,
+        client: Optional[CensusClient] = None,
+    ):
+        self._vintage = vintage
+        self._cache_path = Path(cache_path) if cache_path is not None else None
+        self._offline = offline
+        self._client = client if client is not None else CensusClient()
+
+        self._names: Dict[str, str] = {}
+
+        for names_file in names_files:
+            names_file = Path(names_file)
+            if names_file.exists():
+                self._names.update(read_names_file(names_file))
+            else:
+                logger.warning(f"County names file `{names_file}` does not exist.")
+
+        self._cache = self._read_cache()
+
+    def _read_cache(self) -> Dict[str, str]:
+        if self._cache_path is None or not self._cache_path.exists():
+            return {}
+
+        with open(self._cache_path) as f:
+            cache = json.load(f)
+
+        return cache.get(str(self._vintage), {})
+
+    def _write_cache(self):
+        if self._cache_path is None:
+            return
+
+        # Other vintages share the file, so read it back before
+        # replacing our part of it.
+        if self._cache_path.exists():
+            with open(self._cache_path) as f:
+                cache = json.load(f)
+        else:
+            cache = {}
+
+        cache[str(self._vintage)] = self._cache
+
+        try:
+            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._cache_path, "w") as f:
+                json.dump(cache, f, indent=2, sort_keys=True)
+        except OSError as e:
+            logger.warning(f"Unable to write cache `{self._cache_path}`: {e}")
+
+    def _lookup(self, fips: str) -> Optional[str]:
+        return self._names.get(fips, self._cache.get(fips))
+
+    def names(self, fips_codes: Iterable[str]) -> Dict[str, str]:
+        """
+        Resolve many counties, with at most one request per state.
+
+        Returns
+        -------
+            A dictionary from SSCCC to county name.
+        """
+        fips_codes = list(fips_codes)
+
+        missing_states = sorted(
+            {fips[:2] for fips in fips_codes if self._lookup(fips) is None}
+        )
+
+        if missing_states and not self._offline:
+            self._cache.update(self._client.county_names(missing_states, self._vintage))
+            self._write_cache()
+
+        names = {}
+
+        for fips in fips_codes:
+            name = self._lookup(fips)
+            if name is None:
+                logger.warning(f"No name for county {fips}; using its FIPS code.")
+                name = fips
+            names[fips] = name
+
+        return names
+
+    def name(self, fips: str) -> str:
+        """Resolve a single county."""
+        return self.names([fips])[fips]
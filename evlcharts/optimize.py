@@ -1,47 +1,595 @@
 import logging
+import os
 import sys
+import time
 from argparse import BooleanOptionalAction
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import xgboost
 import yaml
+from bayes_opt import BayesianOptimization, UtilityFunction
+from joblib import Parallel, delayed
 from scipy import stats
 from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold, ParameterSampler
+from threadpoolctl import threadpool_limits
 
+import evlcharts.loader as loader
 import evlcharts.variables as var
+from evlcharts.cvcache import CachedEvaluator, EvaluationCache
 from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.results import ResultsStore
+from evlcharts.variants import (
+    Variant,
+    all_variants,
+    load_county,
+    optional_variant_paths,
+    variant_paths,
+)
+from evlcharts.warmstart import PRIOR_STRATEGIES, load_results, select_prior
 
 logger = logging.getLogger(__name__)
 
 
+PARAM_DISTRIBUTIONS = {
+    "n_estimators": stats.randint(10, 100),
+    "learning_rate": stats.uniform(0.01, 0.07),
+    "subsample": stats.uniform(0.3, 0.7),
+    "max_depth": stats.randint(2, 6),
+    "min_child_weight": stats.randint(1, 4),
+}
+
+# The same search space as bounds for the Bayesian optimizer.
+PARAM_BOUNDS = {
+    "n_estimators": (10, 99),
+    "learning_rate": (0.01, 0.08),
+    "subsample": (0.3, 1.0),
+    "max_depth": (2, 5),
+    "min_child_weight": (1, 3),
+}
+
+INTEGER_PARAMS = ["n_estimators", "max_depth", "min_child_weight"]
+
+SEARCH_STRATEGIES = ["random", "halving", "bayes"]
+
+# Default candidates for each strategy. Halving and bayes are meant to
+# reach the score of a random search with about a tenth of its fits.
+# With five folds, random costs 1000 fits, bayes 100, and halving's
+# rungs of 14, 5 and 2 candidates cost 105.
+DEFAULT_N_ITER = {"random": 200, "halving": 14, "bayes": 20}
+
+ENGINES = ["sklearn", "dmatrix"]
+
+HALVING_RESOURCES = ["n_estimators", "n_samples"]
+
+RANDOM_STATE = 17
+
+
+def _python_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert numpy scalars and bayesian optimizer floats to plain python values."""
+    return {
+        name: int(round(value))
+        if name in INTEGER_PARAMS
+        else value
+        if isinstance(value, str)
+        else float(value)
+        for name, value in params.items()
+    }
+
+
+def _fold_score(
+    params: Dict[str, Any],
+    X: pd.DataFrame,
+    y: pd.Series,
+    w: Optional[pd.Series],
+    train,
+    test,
+    n_threads: Optional[int] = None,
+) -> float:
+    reg_xgb = xgboost.XGBRegressor(**params, n_jobs=n_threads)
+
+    try:
+        reg_xgb.fit(
+            X.iloc[train],
+            y.iloc[train],
+            sample_weight=None if w is None else w.iloc[train],
+        )
+        return float(reg_xgb.score(X.iloc[test], y.iloc[test]))
+    except Exception as e:
+        # Failed fits score 0, as with error_score=0 in sklearn searches.
+        logger.warning(f"Fit failed for {params}: {e}")
+        return 0.0
+
+
+class CrossValidator:
+    """
+    Computes cross validated scores of XGBoost candidates on one
+    county's data.
+
+    Folds are the same as the default for sklearn's searches over
+    regressors, so scores are comparable with what `RandomizedSearchCV`
+    reports.
+
+    If `n_jobs` is positive, fits run in that many parallel jobs, each
+    with a single xgboost thread, so the total number of threads is
+    bounded. With the default of -1, fits use all cores and xgboost
+    uses its own default number of threads.
+    """
+
+    # Whether n_estimators is chosen by early stopping
+    # rather than searched over.
+    early_stopping = False
+
+    def __init__(
+        self,
+        X: pd.DataFrame,
+        y: pd.Series,
+        w: Optional[pd.Series] = None,
+        *,
+        n_splits: int = 5,
+        n_jobs: int = -1,
+    ):
+        self._X = X
+        self._y = y
+        self._w = w
+        self._n_splits = n_splits
+        self._n_jobs = n_jobs
+
+        self.fits = 0
+
+    @property
+    def n_rows(self) -> int:
+        return len(self._X.index)
+
+    @property
+    def n_splits(self) -> int:
+        return self._n_splits
+
+    @property
+    def scheme(self) -> str:
+        """Identifies how candidates are scored, for caching."""
+        return f"sklearn-kfold{self._n_splits}"
+
+    def evaluate(
+        self, candidates: List[Dict[str, Any]], *, n_samples: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Evaluate candidate parameters.
+
+        Parameters
+        ----------
+        candidates
+            The parameters of each candidate.
+        n_samples
+            If not `None`, cross validate on a fixed random
+            subset of this many rows.
+
+        Returns
+        -------
+            A list with a dictionary for each candidate containing
+            its `"params"` and their mean cross validated `"target"`.
+        """
+        X, y, w = self._X, self._y, self._w
+
+        if n_samples is not None and n_samples < self.n_rows:
+            rows = np.random.default_rng(RANDOM_STATE).permutation(self.n_rows)
+            rows = np.sort(rows[:n_samples])
+            X, y = X.iloc[rows], y.iloc[rows]
+            if w is not None:
+                w = w.iloc[rows]
+
+        folds = list(KFold(n_splits=self._n_splits).split(X))
+
+        n_threads = 1 if self._n_jobs > 0 else None
+
+        scores = Parallel(n_jobs=self._n_jobs)(
+            delayed(_fold_score)(params, X, y, w, train, test, n_threads)
+            for params in candidates
+            for train, test in folds
+        )
+
+        self.fits += len(scores)
+
+        targets = np.mean(np.reshape(scores, (len(candidates), len(folds))), axis=1)
+
+        return [
+            {"params": params, "target": float(target)}
+            for params, target in zip(candidates, targets)
+        ]
+
+
+class DMatrixCrossValidator:
+    """
+    Computes cross validated scores of XGBoost candidates on one
+    county's data using `xgboost.train` directly.
+
+    The quantized training matrix and the validation matrix for each
+    fold are built once, when the validator is constructed, and shared
+    by every candidate, so the data is only converted and sketched once
+    per county. Rather than searching over `n_estimators`, each candidate
+    boosts for up to `max_rounds` rounds with early stopping on the
+    validation fold, and the mean best number of rounds across folds
+    becomes its `n_estimators`.
+
+    Folds are the same as those used by :py:class:`CrossValidator`.
+    """
+
+    early_stopping = True
+
+    def __init__(
+        self,
+        X: pd.DataFrame,
+        y: pd.Series,
+        w: Optional[pd.Series] = None,
+        *,
+        n_splits: int = 5,
+        n_jobs: int = -1,
+        max_rounds: int = PARAM_BOUNDS["n_estimators"][1],
+        early_stopping_rounds: int = 10,
+    ):
+        self._n_rows = len(X.index)
+        self._n_splits = n_splits
+        self._n_jobs = n_jobs
+        self._max_rounds = max_rounds
+        self._early_stopping_rounds = early_stopping_rounds
+
+        self._folds = []
+
+        for train, test in KFold(n_splits=n_splits).split(X):
+            dtrain = xgboost.QuantileDMatrix(
+                X.iloc[train],
+                label=y.iloc[train],
+                weight=None if w is None else w.iloc[train],
+                nthread=n_jobs,
+            )
+            dtest = xgboost.QuantileDMatrix(
+                X.iloc[test], label=y.iloc[test], ref=dtrain, nthread=n_jobs
+            )
+            self._folds.append((dtrain, dtest, y.iloc[test].to_numpy()))
+
+        self.fits = 0
+
+    @property
+    def n_rows(self) -> int:
+        return self._n_rows
+
+    @property
+    def n_splits(self) -> int:
+        return self._n_splits
+
+    @property
+    def scheme(self) -> str:
+        """Identifies how candidates are scored, for caching."""
+        return (
+            f"dmatrix-kfold{self._n_splits}"
+            f"-es{self._early_stopping_rounds}-max{self._max_rounds}"
+        )
+
+    def _booster_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        booster_params = {
+            name: value for name, value in params.items() if name != "n_estimators"
+        }
+        booster_params["objective"] = "reg:squarederror"
+        booster_params["tree_method"] = "hist"
+        if self._n_jobs > 0:
+            booster_params["nthread"] = self._n_jobs
+
+        return booster_params
+
+    def _fold_score(
+        self, params: Dict[str, Any], dtrain, dtest, y_test
+    ) -> Tuple[float, int]:
+        try:
+            booster = xgboost.train(
+                self._booster_params(params),
+                dtrain,
+                num_boost_round=params.get("n_estimators", self._max_rounds),
+                evals=[(dtest, "test")],
+                early_stopping_rounds=self._early_stopping_rounds,
+                verbose_eval=False,
+            )
+            rounds = booster.best_iteration + 1
+            y_hat = booster.predict(dtest, iteration_range=(0, rounds))
+            return float(r2_score(y_test, y_hat)), rounds
+        except Exception as e:
+            # Failed fits score 0, as with error_score=0 in sklearn searches.
+            logger.warning(f"Fit failed for {params}: {e}")
+            return 0.0, params.get("n_estimators", self._max_rounds)
+
+    def evaluate(
+        self, candidates: List[Dict[str, Any]], *, n_samples: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Evaluate candidate parameters.
+
+        Parameters
+        ----------
+        candidates
+            The parameters of each candidate. If `n_estimators`
+            is present it caps the number of boosting rounds.
+        n_samples
+            Not supported, since the fold matrices are fixed.
+
+        Returns
+        -------
+            A list with a dictionary for each candidate containing
+            its `"params"`, including the `n_estimators` found by early
+            stopping, and their mean cross validated `"target"`.
+        """
+        if n_samples is not None:
+            raise ValueError("The dmatrix engine cannot subsample rows.")
+
+        evaluations = []
+
+        for params in candidates:
+            fold_scores = [
+                self._fold_score(params, dtrain, dtest, y_test)
+                for dtrain, dtest, y_test in self._folds
+            ]
+            self.fits += len(fold_scores)
+
+            scores, rounds = zip(*fold_scores)
+
+            evaluations.append(
+                {
+                    "params": {
+                        **params,
+                        "n_estimators": int(round(np.mean(rounds))),
+                        "tree_method": "hist",
+                    },
+                    "target": float(np.mean(scores)),
+                }
+            )
+
+        return evaluations
+
+
+Evaluator = Union[CrossValidator, DMatrixCrossValidator, CachedEvaluator]
+
+
+def _search_distributions(evaluator: Evaluator) -> Dict[str, Any]:
+    """The distributions to sample candidates from for an evaluator."""
+    return {
+        name: distribution
+        for name, distribution in PARAM_DISTRIBUTIONS.items()
+        if not (evaluator.early_stopping and name == "n_estimators")
+    }
+
+
+def _search_bounds(evaluator: Evaluator) -> Dict[str, Any]:
+    """The bounds for the Bayesian optimizer for an evaluator."""
+    return {
+        name: bounds
+        for name, bounds in PARAM_BOUNDS.items()
+        if not (evaluator.early_stopping and name == "n_estimators")
+    }
+
+
+def _prior_candidates(
+    evaluator: Evaluator, prior: Optional[List[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Turn the params in a prior into candidates for an evaluator.
+
+    Params are clipped to the search space and anything outside of
+    it, like `n_estimators` for an evaluator that uses early stopping,
+    is dropped. Priors that don't cover the whole space are skipped.
+    """
+    if prior is None:
+        return []
+
+    bounds = _search_bounds(evaluator)
+
+    return [
+        _python_params(
+            {
+                name: min(max(params[name], low), high)
+                for name, (low, high) in bounds.items()
+            }
+        )
+        for params in prior
+        if all(name in params for name in bounds)
+    ]
+
+
+def _sampled_candidates(
+    evaluator: Evaluator,
+    n_iter: int,
+    random_state: int,
+    prior: Optional[List[Dict[str, Any]]],
+) -> List[Dict[str, Any]]:
+    """The candidates from the prior followed by random ones, `n_iter` in all."""
+    candidates = _prior_candidates(evaluator, prior)
+
+    candidates.extend(
+        _python_params(params)
+        for params in ParameterSampler(
+            _search_distributions(evaluator),
+            max(0, n_iter - len(candidates)),
+            random_state=random_state,
+        )
+    )
+
+    return candidates
+
+
+def random_search(
+    evaluator: Evaluator,
+    n_iter: int,
+    random_state: int,
+    *,
+    prior: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Evaluate `n_iter` candidates drawn at random from the search space.
+
+    If there is a `prior`, its params are evaluated first and take
+    the place of some of the random candidates.
+    """
+    return evaluator.evaluate(
+        _sampled_candidates(evaluator, n_iter, random_state, prior)
+    )
+
+
+def _halving_schedule(min_resource: int, max_resource: int, factor: int) -> List[int]:
+    """Resources for each rung, ending at `max_resource`."""
+    schedule = [max_resource]
+
+    while schedule[0] // factor >= min_resource:
+        schedule.insert(0, schedule[0] // factor)
+
+    return schedule
+
+
+def halving_search(
+    evaluator: Evaluator,
+    n_iter: int,
+    random_state: int,
+    *,
+    resource: str = "n_estimators",
+    factor: int = 3,
+    prior: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Successive halving.
+
+    All `n_iter` candidates, including any from the `prior`, are
+    evaluated with a small amount of the resource, either boosting
+    rounds or rows. The best `1 / factor` of them are kept and evaluated
+    again with `factor` times as much, until the survivors are evaluated
+    with all of it.
+
+    Returns
+    -------
+        The evaluations from the final rung.
+    """
+    candidates = _sampled_candidates(evaluator, n_iter, random_state, prior)
+
+    if resource == "n_estimators":
+        low, high = PARAM_BOUNDS["n_estimators"]
+        schedule = _halving_schedule(low, high, factor)
+    elif resource == "n_samples":
+        schedule = _halving_schedule(20 * evaluator.n_splits, evaluator.n_rows, factor)
+    else:
+        raise ValueError(f"Unknown halving resource {resource}.")
+
+    for rung, amount in enumerate(schedule):
+        logger.info(
+            f"Halving rung {rung}: {len(candidates)} candidates with {resource}={amount}."
+        )
+
+        if resource == "n_estimators":
+            evaluations = evaluator.evaluate(
+                [{**params, "n_estimators": amount} for params in candidates]
+            )
+        else:
+            evaluations = evaluator.evaluate(candidates, n_samples=amount)
+
+        if rung < len(schedule) - 1:
+            survivors = max(1, -(-len(candidates) // factor))
+            evaluations.sort(key=lambda evaluation: -evaluation["target"])
+            candidates = [
+                evaluation["params"] for evaluation in evaluations[:survivors]
+            ]
+
+    return evaluations
+
+
+def bayes_search(
+    evaluator: Evaluator,
+    n_iter: int,
+    random_state: int,
+    *,
+    prior: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Bayesian optimization with a budget of `n_iter` candidates.
+
+    The first fifth of the budget is spent on the params in the
+    `prior`, if any, and random points, which are evaluated together.
+    The rest are suggested one at a time by the optimizer.
+    """
+    optimizer = BayesianOptimization(
+        f=None,
+        pbounds=_search_bounds(evaluator),
+        random_state=random_state,
+        verbose=0,
+        allow_duplicate_points=True,
+    )
+    utility = UtilityFunction(kind="ucb", kappa=2.576)
+
+    points = _prior_candidates(evaluator, prior)[:n_iter]
+
+    init_points = max(len(points), min(n_iter, max(5, n_iter // 5)))
+
+    points.extend(
+        optimizer.space.array_to_params(optimizer.space.random_sample())
+        for _ in range(init_points - len(points))
+    )
+    evaluations = evaluator.evaluate([_python_params(point) for point in points])
+
+    for point, evaluation in zip(points, evaluations):
+        optimizer.register(params=point, target=evaluation["target"])
+
+    for _ in range(n_iter - init_points):
+        point = optimizer.suggest(utility)
+        [evaluation] = evaluator.evaluate([_python_params(point)])
+        optimizer.register(params=point, target=evaluation["target"])
+        evaluations.append(evaluation)
+
+    return evaluations
+
+
+def _search_settings(search: Dict[str, Any]) -> Tuple:
+    """The settings of a recorded search that determine what it costs."""
+    return (
+        search.get("strategy"),
+        search.get("engine"),
+        search.get("n_iter"),
+        search.get("resource"),
+    )
+
+
 def optimize(
     df: pd.DataFrame,
     x_cols: Iterable[str],
     y_col: str,
     w_col: Optional[str] = None,
+    *,
+    search: str = "random",
+    n_iter: Optional[int] = None,
+    halving_resource: str = "n_estimators",
+    engine: str = "sklearn",
+    n_jobs: int = -1,
+    cache: Optional[EvaluationCache] = None,
+    population: str = "",
+    prior: Optional[Dict[str, Any]] = None,
+    previous: Optional[Dict[str, Any]] = None,
+    drift_tolerance: float = 0.02,
 ) -> Dict[str, Any]:
-    reg_xgb = xgboost.XGBRegressor()
-
-    param_dist = {
-        "n_estimators": stats.randint(10, 100),
-        "learning_rate": stats.uniform(0.01, 0.07),
-        "subsample": stats.uniform(0.3, 0.7),
-        "max_depth": stats.randint(2, 6),
-        "min_child_weight": stats.randint(1, 4),
-    }
+    """
+    Search for the best XGBoost params for a county.
 
-    reg = RandomizedSearchCV(
-        reg_xgb,
-        param_distributions=param_dist,
-        n_iter=200,
-        error_score=0,
-        n_jobs=-1,
-        verbose=1,
-        random_state=17,
-    )
+    If there is a `previous` result, e.g. from before a year was added
+    to the data, its params are evaluated on the data first. If their
+    cross validated target is no more than `drift_tolerance` below what
+    it was, they are reused and the search is skipped.
+
+    If `n_iter` is `None`, the strategy's default from
+    :py:data:`DEFAULT_N_ITER` is used.
+    """
+    if n_iter is None:
+        n_iter = DEFAULT_N_ITER[search]
 
     X = df[list(x_cols)]
     y = df[y_col]
@@ -51,16 +599,140 @@ def optimize(
     else:
         w = None
 
-    reg.fit(X, y, sample_weight=w)
+    start = time.perf_counter()
+
+    if engine == "sklearn":
+        evaluator = CrossValidator(X, y, w, n_jobs=n_jobs)
+    elif engine == "dmatrix":
+        evaluator = DMatrixCrossValidator(X, y, w, n_jobs=n_jobs)
+    else:
+        raise ValueError(f"Unknown engine {engine}.")
+
+    if cache is not None:
+        evaluator = CachedEvaluator(
+            evaluator,
+            cache,
+            data_hash=loader.data_hash(X, y, w),
+            y_col=y_col,
+            population=population,
+        )
+
+    prior_params = None if prior is None else prior["params"]
+
+    settings = _search_settings(
+        {
+            "strategy": search,
+            "engine": engine,
+            "n_iter": n_iter,
+            "resource": halving_resource if search == "halving" else None,
+        }
+    )
+
+    incremental = None
+
+    if previous is not None:
+        [evaluation] = evaluator.evaluate([previous["params"]])
+        drift = previous["target"] - evaluation["target"]
+
+        # What a full, uncached search with these settings cost, if the
+        # previous result knows. It doesn't if it came from the CV cache,
+        # used other settings, or predates searches being recorded.
+        previous_search = previous.get("search", {})
+        if _search_settings(previous_search) == settings:
+            full_wall_time = previous_search.get("full_wall_time")
+        else:
+            full_wall_time = None
+
+        incremental = {
+            "reused": bool(drift <= drift_tolerance),
+            "previous_target": float(previous["target"]),
+            "drift": float(drift),
+            "drift_tolerance": drift_tolerance,
+            "full_wall_time": full_wall_time,
+        }
+
+        if incremental["reused"]:
+            logger.info(
+                f"Reusing previous params; target moved from "
+                f"{previous['target']:.4f} to {evaluation['target']:.4f}."
+            )
+        else:
+            logger.info(
+                f"Previous params drifted by {drift:.4f}, more than "
+                f"{drift_tolerance}; searching again."
+            )
+
+    if incremental is not None and incremental["reused"]:
+        evaluations = [evaluation]
+    elif search == "random":
+        evaluations = random_search(evaluator, n_iter, RANDOM_STATE, prior=prior_params)
+    elif search == "halving":
+        evaluations = halving_search(
+            evaluator,
+            n_iter,
+            RANDOM_STATE,
+            resource=halving_resource,
+            prior=prior_params,
+        )
+    elif search == "bayes":
+        evaluations = bayes_search(evaluator, n_iter, RANDOM_STATE, prior=prior_params)
+    else:
+        raise ValueError(f"Unknown search strategy {search}.")
+
+    best = max(evaluations, key=lambda evaluation: evaluation["target"])
+
+    reg_xgb = xgboost.XGBRegressor(
+        **best["params"], n_jobs=n_jobs if n_jobs > 0 else None
+    )
+    reg_xgb.fit(X, y, sample_weight=w)
+
+    wall_time = time.perf_counter() - start
+
+    logger.info(
+        f"Search {search}: best target {best['target']:.4f} "
+        f"from {n_iter} candidates after {evaluator.fits} fits in {wall_time:.1f}s."
+    )
 
     result = {
-        "params": reg.best_params_,
-        "target": float(reg.best_score_),
-        "score": float(reg.best_estimator_.score(X, y, sample_weight=w)),
+        "params": best["params"],
+        "target": float(best["target"]),
+        "score": float(reg_xgb.score(X, y, sample_weight=w)),
+        "search": {
+            "strategy": search,
+            "engine": engine,
+            "n_iter": n_iter,
+            "fits": evaluator.fits,
+            "wall_time": round(wall_time, 3),
+        },
     }
 
-    result["params"]["learning_rate"] = float(result["params"]["learning_rate"])
-    result["params"]["subsample"] = float(result["params"]["subsample"])
+    if search == "halving":
+        result["search"]["resource"] = halving_resource
+
+    if cache is not None:
+        result["search"]["cache_hits"] = evaluator.hits
+
+    if prior is not None:
+        result["search"]["prior"] = prior
+
+    if incremental is not None and incremental["reused"]:
+        full_wall_time = incremental["full_wall_time"]
+        incremental["seconds_saved"] = (
+            None if full_wall_time is None else round(full_wall_time - wall_time, 3)
+        )
+    elif cache is None or evaluator.hits == 0:
+        # Only a search with no cache hits measures what one costs.
+        full_wall_time = round(wall_time, 3)
+    else:
+        full_wall_time = None
+
+    result["search"]["full_wall_time"] = full_wall_time
+
+    if incremental is not None:
+        if not incremental["reused"]:
+            incremental["full_wall_time"] = full_wall_time
+            incremental["seconds_saved"] = 0.0
+        result["search"]["incremental"] = incremental
 
     return result
 
@@ -90,92 +762,583 @@ def linreg(
     }
 
 
+def optimize_variant(
+    df: pd.DataFrame,
+    x_cols: List[str],
+    output_path: Path,
+    fips: str,
+    *,
+    population: str = "renters",
+    y_col: str = "filing_rate",
+    search: str = "random",
+    n_iter: Optional[int] = None,
+    halving_resource: str = "n_estimators",
+    engine: str = "sklearn",
+    cv_cache: Optional[Path] = None,
+    results: Optional[Path] = None,
+    warm_start: Optional[Path] = None,
+    prior_strategy: str = "state",
+    prior_size: int = 5,
+    incremental: bool = False,
+    drift_tolerance: float = 0.02,
+    n_jobs: int = -1,
+    dry_run: bool = False,
+) -> bool:
+    """
+    Optimize one population and y column of a county and write its params file.
+
+    Parameters
+    ----------
+    df
+        The county's data, from :py:func:`evlcharts.variants.load_county`.
+    x_cols
+        The X columns of `population`.
+    incremental
+        If `output_path` already exists, reuse its params unless they
+        have drifted by more than `drift_tolerance`. See :py:func:`optimize`.
+
+    Returns
+    -------
+        `False` if there was no data left for the county after
+        removing rows where `y_col` is missing, otherwise `True`.
+    """
+    # Weigh by total renters.
+    w_col = var.VARIABLE_TOTAL_RENTERS
+
+    df = df[x_cols + [y_col, w_col]]
+
+    logger.info(f"Input shape: {df.shape}")
+    df = df.dropna(subset=[y_col])
+    logger.info(f"Shape after dropna: {df.shape}")
+
+    if len(df.index) == 0:
+        logger.warning(f"After removing nan from {y_col}, no data is left.")
+        return False
+
+    logger.info(
+        f"Range: {df[y_col].min()} - {df[y_col].max()}; mean: {df[y_col].mean()}"
+    )
+
+    if dry_run:
+        return True
+
+    logger.info(f"All X shape: {df.shape}")
+    df_linreg = df.dropna(subset=x_cols)
+    logger.info(f"Dropna X shape: {df_linreg.shape}")
+
+    linreg_params = linreg(df_linreg, x_cols, y_col)
+
+    if warm_start is not None:
+        prior = select_prior(
+            load_results(warm_start, exclude_fips=fips),
+            fips,
+            strategy=prior_strategy,
+            rows=len(df.index),
+            linreg_score=linreg_params["score"],
+            n=prior_size,
+        )
+        logger.info(f"Warm starting from counties {prior['fips']}")
+    else:
+        prior = None
+
+    previous = None
+
+    if incremental and output_path.exists():
+        with open(output_path) as f:
+            previous = yaml.full_load(f)["xgb"]
+        logger.info(f"Checking previous params from `{output_path}`")
+
+    cache = EvaluationCache(cv_cache) if cv_cache is not None else None
+
+    xgb_params = optimize(
+        df,
+        x_cols,
+        y_col,
+        w_col=w_col,
+        search=search,
+        n_iter=n_iter,
+        halving_resource=halving_resource,
+        engine=engine,
+        n_jobs=n_jobs,
+        cache=cache,
+        population=population,
+        prior=prior,
+        previous=previous,
+        drift_tolerance=drift_tolerance,
+    )
+
+    if cache is not None:
+        cache.close()
+
+    logger.info(f"Writing to output file `{output_path}`")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    params = {
+        "fips": fips,
+        "rows": len(df.index),
+        "linreg": linreg_params,
+        "xgb": xgb_params,
+    }
+    with open(output_path, "w") as f:
+        yaml.dump(params, f, sort_keys=True)
+
+    if results is not None:
+        logger.info(f"Storing results in `{results}`")
+        store = ResultsStore(results)
+        store.put(params, population=population, y_col=y_col)
+        store.close()
+
+    return True
+
+
+def optimize_county(
+    data_path: Path,
+    output_path: Path,
+    fips: str,
+    *,
+    population: str = "renters",
+    y_col: str = "filing_rate",
+    **kwargs,
+) -> bool:
+    """
+    Optimize one county and write its params file.
+
+    Parameters
+    ----------
+    kwargs
+        Passed on to :py:func:`optimize_variant`.
+
+    Returns
+    -------
+        `False` if there was no data left for the county after
+        removing rows where `y_col` is missing, otherwise `True`.
+    """
+    df, x_cols = load_county(data_path, fips, [population], [y_col])
+
+    return optimize_variant(
+        df,
+        x_cols[population],
+        output_path,
+        fips,
+        population=population,
+        y_col=y_col,
+        **kwargs,
+    )
+
+
+def params_file_name(fips: str) -> str:
+    return f"xgb-params-{fips}.yaml"
+
+
+def county_size(data_path: Path, fips: str) -> int:
+    """Bytes of data for a county, which we use to schedule big counties first."""
+    if data_path.is_dir():
+        county_dir = data_path / f"STATE={fips[:2]}" / f"COUNTY={fips[2:]}"
+        return sum(p.stat().st_size for p in county_dir.rglob("*") if p.is_file())
+
+    return data_path.stat().st_size
+
+
+# Thread pool limits for worker processes. We hold a reference
+# so they stay in effect for the life of the worker.
+_thread_limits = None
+
+
+def _init_worker(threads: int):
+    """Pin the BLAS and OpenMP thread pools of a worker process."""
+    global _thread_limits
+
+    for env_var in [
+        "OMP_NUM_THREADS",
+        "OPENBLAS_NUM_THREADS",
+        "MKL_NUM_THREADS",
+        "VECLIB_MAXIMUM_THREADS",
+    ]:
+        os.environ[env_var] = str(threads)
+
+    _thread_limits = threadpool_limits(limits=threads)
+
+
+def optimize_counties(
+    data_path: Path,
+    output_dir: str,
+    fips_list: List[str],
+    *,
+    variants: List[Variant],
+    workers: int,
+    threads: int,
+    force: bool = False,
+    warm_start: Optional[str] = None,
+    **kwargs,
+) -> List[str]:
+    """
+    Optimize many counties in one pool of worker processes.
+
+    Each county's data is read once, in this process, and each of its
+    variants, i.e. populations and y columns, is a separate task for
+    the pool. Each of the `workers` processes runs one task at a time
+    with `threads` threads, so the total is `workers * threads` no
+    matter how big or small the counties are. Counties are submitted
+    biggest first so that the longest ones don't start last, and only
+    a few more than the workers can start are read ahead, so memory
+    use does not grow with the number of counties.
+
+    Variants whose params file is newer than the county's data are
+    skipped unless `force` is set.
+
+    Parameters
+    ----------
+    data_path
+        A directory of county files or a file or dataset of many counties.
+    output_dir
+        Where to write params files. A template, see
+        :py:mod:`evlcharts.variants`, if there is more than one variant.
+    fips_list
+        The counties to optimize.
+    variants
+        The populations and y columns to optimize each county for.
+    workers
+        How many worker processes.
+    threads
+        How many threads each worker uses.
+    force
+        Optimize even counties that look up to date.
+    warm_start
+        Directory of params files to warm start from. A template like
+        `output_dir`.
+    kwargs
+        Passed on to :py:func:`optimize_variant`.
+
+    Returns
+    -------
+        The counties that failed, or, if there is only one variant,
+        had no data. With several variants, counties with no data for
+        some of them are expected and are skipped.
+    """
+    output_dirs = variant_paths(output_dir, variants)
+    warm_starts = optional_variant_paths(warm_start, variants)
+
+    jobs = []
+    failed = []
+
+    for fips in fips_list:
+        try:
+            county_path = loader.county_data_path(data_path, fips)
+        except FileNotFoundError as e:
+            logger.error(e)
+            failed.append(fips)
+            continue
+
+        output_paths = {}
+
+        for variant in variants:
+            output_path = output_dirs[variant] / params_file_name(fips)
+
+            if (
+                not force
+                and output_path.exists()
+                and output_path.stat().st_mtime >= county_path.stat().st_mtime
+            ):
+                logger.info(f"Skipping {fips}; `{output_path}` is up to date.")
+                continue
+
+            output_paths[variant] = output_path
+
+        if output_paths:
+            jobs.append(
+                (county_size(county_path, fips), fips, county_path, output_paths)
+            )
+
+    jobs.sort(key=lambda job: -job[0])
+
+    logger.info(
+        f"Optimizing {sum(len(job[3]) for job in jobs)} variants of {len(jobs)} "
+        f"counties with {workers} workers of {threads} threads each."
+    )
+
+    futures = {}
+
+    def finish(done):
+        for future in done:
+            fips, (population, y_col) = futures.pop(future)
+            try:
+                if future.result():
+                    logger.info(f"Finished {fips} for {population} {y_col}.")
+                elif len(variants) > 1:
+                    logger.info(f"Skipped {fips} for {population} {y_col}; no data.")
+                else:
+                    failed.append(fips)
+            except Exception as e:
+                logger.error(f"Failed to optimize {fips} for {population} {y_col}: {e}")
+                failed.append(fips)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(threads,)
+    ) as executor:
+        for _, fips, county_path, output_paths in jobs:
+            populations = dict.fromkeys(population for population, _ in output_paths)
+            y_cols = dict.fromkeys(y_col for _, y_col in output_paths)
+
+            df, x_cols = load_county(county_path, fips, populations, y_cols)
+
+            for variant, output_path in output_paths.items():
+                population, y_col = variant
+                future = executor.submit(
+                    optimize_variant,
+                    # Only send the worker the columns it needs.
+                    df[x_cols[population] + [y_col, var.VARIABLE_TOTAL_RENTERS]],
+                    x_cols[population],
+                    output_path,
+                    fips,
+                    population=population,
+                    y_col=y_col,
+                    warm_start=warm_starts[variant],
+                    n_jobs=threads,
+                    **kwargs,
+                )
+                futures[future] = (fips, variant)
+
+            while len(futures) > 2 * workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                finish(done)
+
+        finish(as_completed(list(futures)))
+
+    return sorted(set(failed))
+
+
 def main():
     parser = LoggingArgumentParser(logger)
 
-    parser.add_argument(
+    fips_group = parser.add_mutually_exclusive_group(required=True)
+
+    fips_group.add_argument(
         "--fips",
         type=str,
-        required=True,
         help="Provide this as SSCCC for the state and county.",
     )
 
+    fips_group.add_argument(
+        "--fips-list",
+        type=str,
+        nargs="+",
+        help="Optimize all of these counties in one process pool. "
+        "Then data is a directory of county files or a multi-county "
+        "dataset, and output is a directory.",
+    )
+
     parser.add_argument("--dry-run", action=BooleanOptionalAction)
     parser.add_argument(
-        "-o", "--output", required=True, type=str, help="Output yaml file."
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="Output yaml file, or directory with --fips-list. With several "
+        "populations or y columns, a template with {population} and {y} in it.",
     )
 
     parser.add_argument(
         "--population",
         type=str,
+        nargs="+",
         choices=["all", "renters"],
-        default="renters",
+        default=["renters"],
         required=True,
-        help="What do we base the population metrics on?",
+        help="What do we base the population metrics on? Give several to "
+        "optimize each of them from one read of the data.",
     )
 
     parser.add_argument(
         "-y",
         "--y-column",
         type=str,
+        nargs="+",
         choices=["filing_rate", "threatened_rate", "judgement_rate"],
-        default="filing_rate",
-        help="What variable are we trying to predict?",
+        default=["filing_rate"],
+        help="What variable are we trying to predict? Give several to "
+        "optimize each of them from one read of the data.",
     )
 
-    parser.add_argument("data", help="Input data file. Typically from select.py.")
+    parser.add_argument(
+        "--search",
+        choices=SEARCH_STRATEGIES,
+        default="random",
+        help="Hyperparameter search strategy.",
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--n-iter",
+        type=int,
+        help="Number of candidates to search. Each costs one fit per CV fold. "
+        "Defaults to "
+        + ", ".join(f"{n} for {strategy}" for strategy, n in DEFAULT_N_ITER.items())
+        + ".",
+    )
 
-    renters_only = args.population == "renters"
+    parser.add_argument(
+        "--halving-resource",
+        choices=HALVING_RESOURCES,
+        default="n_estimators",
+        help="What to grow between rungs of --search halving.",
+    )
 
-    data_path = Path(args.data)
-    output_path = Path(args.output)
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="sklearn",
+        help="How to fit candidates. dmatrix reuses quantized fold matrices "
+        "and picks n_estimators by early stopping.",
+    )
 
-    df = pd.read_csv(
-        data_path, header=0, dtype={"STATE": str, "COUNTY": str, "TRACT": str}
+    parser.add_argument(
+        "--cv-cache",
+        type=str,
+        help="SQLite file of previously evaluated candidates to reuse and extend.",
     )
 
-    x_cols = var.x_cols(df, renters_only)
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="SQLite results store to also write each county's result to.",
+    )
 
-    y_col = args.y_column
+    parser.add_argument(
+        "--warm-start",
+        type=str,
+        help="Directory of params files from already optimized counties "
+        "to seed the search with. A template like --output.",
+    )
 
-    # Weigh by total renters.
-    w_col = var.VARIABLE_TOTAL_RENTERS
+    parser.add_argument(
+        "--prior",
+        choices=PRIOR_STRATEGIES,
+        default="state",
+        help="How to choose the counties to seed a --warm-start search with.",
+    )
 
-    logger.info(f"Input shape: {df.shape}")
-    df = df.dropna(subset=[y_col])
-    logger.info(f"Shape after dropna: {df.shape}")
+    parser.add_argument(
+        "--prior-size",
+        type=int,
+        default=5,
+        help="How many counties to seed a --warm-start search with.",
+    )
 
-    if len(df.index) == 0:
-        logger.warning(f"After removing nan from {y_col}, no data is left.")
-        sys, exit(1)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Threads per county. Defaults to all cores for --fips "
+        "and 1 for --fips-list.",
+    )
 
-    logger.info(
-        f"Range: {df[y_col].min()} - {df[y_col].max()}; mean: {df[y_col].mean()}"
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes for --fips-list. Defaults to cores / threads.",
     )
 
-    if args.dry_run:
-        return
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="With --fips-list, optimize counties even if their params are up to date.",
+    )
 
-    xgb_params = optimize(df, x_cols, y_col, w_col=w_col)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the params already in the output file unless they "
+        "have drifted on the current data.",
+    )
 
-    logger.info(f"Writing to output file `{output_path}`")
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    parser.add_argument(
+        "--drift-tolerance",
+        type=float,
+        default=0.02,
+        help="How far the cross validated score of the previous params may "
+        "fall before --incremental searches again.",
+    )
 
-    logger.info(f"All X shape: {df.shape}")
-    df = df.dropna(subset=x_cols)
-    logger.info(f"Dropna X shape: {df.shape}")
+    parser.add_argument("data", help="Input data file. Typically from select.py.")
 
-    linreg_params = linreg(df, x_cols, y_col)
+    args = parser.parse_args()
 
-    params = {
-        "fips": args.fips,
-        "linreg": linreg_params,
-        "xgb": xgb_params,
-    }
-    with open(output_path, "w") as f:
-        yaml.dump(params, f, sort_keys=True)
+    if args.engine == "dmatrix" and (
+        args.search == "halving" and args.halving_resource == "n_samples"
+    ):
+        parser.error("--engine dmatrix does not support --halving-resource n_samples.")
+
+    data_path = Path(args.data)
+
+    variants = all_variants(args.population, args.y_column)
+
+    try:
+        output_paths = variant_paths(args.output, variants)
+        warm_starts = optional_variant_paths(args.warm_start, variants)
+    except ValueError as e:
+        parser.error(str(e))
+
+    kwargs = dict(
+        search=args.search,
+        n_iter=args.n_iter,
+        halving_resource=args.halving_resource,
+        engine=args.engine,
+        cv_cache=Path(args.cv_cache) if args.cv_cache is not None else None,
+        results=Path(args.results) if args.results is not None else None,
+        prior_strategy=args.prior,
+        prior_size=args.prior_size,
+        incremental=args.incremental,
+        drift_tolerance=args.drift_tolerance,
+        dry_run=args.dry_run,
+    )
+
+    if args.fips_list is not None:
+        threads = args.threads if args.threads is not None else 1
+        workers = (
+            args.workers
+            if args.workers is not None
+            else max(1, (os.cpu_count() or 1) // threads)
+        )
+
+        failed = optimize_counties(
+            data_path,
+            args.output,
+            args.fips_list,
+            variants=variants,
+            workers=workers,
+            threads=threads,
+            force=args.force,
+            warm_start=args.warm_start,
+            **kwargs,
+        )
+
+        if failed:
+            logger.warning(f"Counties that failed: {' '.join(sorted(failed))}")
+            sys.exit(1)
+    else:
+        threads = args.threads if args.threads is not None else -1
+
+        # Every variant is optimized from the one read of the data.
+        df, x_cols = load_county(data_path, args.fips, args.population, args.y_column)
+
+        no_data = []
+
+        for variant in variants:
+            population, y_col = variant
+            if not optimize_variant(
+                df,
+                x_cols[population],
+                output_paths[variant],
+                args.fips,
+                population=population,
+                y_col=y_col,
+                warm_start=warm_starts[variant],
+                n_jobs=threads,
+                **kwargs,
+            ):
+                no_data.append(f"{population} {y_col}")
+
+        # With several variants, some of them having no data is expected.
+        if no_data and len(variants) == 1:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import logging
-from argparse import BooleanOptionalAction
+import sys
+import time
+from argparse import ArgumentTypeError, BooleanOptionalAction
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 import numpy as np
 import pandas as pd
@@ -10,12 +12,35 @@ from impactchart.model import XGBoostImpactModel
 from matplotlib.ticker import FuncFormatter, PercentFormatter
 from sklearn.linear_model import LinearRegression
 
+import evlcharts.loader as loader
 import evlcharts.variables as var
+from evlcharts.ensemble import AdaptiveXGBoostImpactModel, ParallelXGBoostImpactModel
 from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.modelcache import ModelCache, model_key
+from evlcharts.names import CountyNames
+from evlcharts.variants import (
+    all_variants,
+    load_county,
+    optional_variant_paths,
+    variant_paths,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _positive_int(value: str) -> int:
+    """An argparse type for counts of estimators, which must be at least one."""
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+
+    if n < 1:
+        raise ArgumentTypeError(f"{value} is not a positive integer.")
+
+    return n
+
+
 def _linreg_from_coefficients(coef, intercept):
     reg_linreg = LinearRegression()
     # Instead of fitting, we are just going to kludge in
@@ -29,6 +54,49 @@ def _plot_id(feature, k, n, seed):
     return f"(f = {feature}; n = {n:,.0f}; k = {k}; s = {seed:08X})"
 
 
+def bucketed_impacts(
+    impact_model: XGBoostImpactModel, X: pd.DataFrame, buckets: int = 10
+) -> pd.DataFrame:
+    """
+    The mean impact of each feature within each of its quantile buckets.
+
+    This gives the same buckets as calling `impact_model.bucketed_impact`
+    for each feature, but averages the ensemble's impacts and buckets
+    every feature in one pass.
+
+    Returns
+    -------
+        A data frame with a `DECILE` column numbering the buckets from
+        0, a `K` column with the size of the ensemble the impacts came
+        from and a column of mean impacts for each feature.
+    """
+    features = list(X.columns)
+
+    # Impacts are indexed by position in X, not by its index labels.
+    mean_impact = impact_model.impact(X).groupby("X_index")[features].mean().to_numpy()
+
+    n = len(X.index)
+
+    # Sort each feature's impacts by its values, with the same sort
+    # pandas uses, so ties fall into the same buckets.
+    order = np.argsort(X.to_numpy(), axis=0, kind="quicksort")
+    sorted_impact = np.take_along_axis(mean_impact, order, axis=0)
+
+    bucket = (np.arange(n) // (n * 1.0 / buckets)).astype(int)
+
+    df_buckets = (
+        pd.DataFrame(sorted_impact, columns=features)
+        .groupby(bucket)
+        .mean()
+        .rename_axis("DECILE")
+        .reset_index()
+    )
+
+    df_buckets.insert(1, "K", impact_model.k)
+
+    return df_buckets
+
+
 def plot_impact_chars(
     impact_model: XGBoostImpactModel,
     X: pd.DataFrame,
@@ -111,12 +179,316 @@ def plot_impact_chars(
         fig.savefig(output_path / f"{feature_name.replace(' ', '-')}.png")
 
 
+def bucket_changes(df_before: pd.DataFrame, df_after: pd.DataFrame) -> Dict[str, float]:
+    """
+    How far each feature's bucketed mean impacts moved.
+
+    Moves are relative to the range of all of the bucketed mean
+    impacts after, since the charts share a y axis.
+    """
+    features = [col for col in df_after.columns if col not in ["DECILE", "K"]]
+
+    after = df_after[features].to_numpy()
+    scale = after.max() - after.min()
+
+    if scale <= 0:
+        scale = 1.0
+
+    return {
+        feature: float(
+            np.abs(after[:, ii] - df_before[feature].to_numpy()).max() / scale
+        )
+        for ii, feature in enumerate(features)
+    }
+
+
+def _updatable(
+    latest: Optional[Dict[str, Any]],
+    X: pd.DataFrame,
+    xgb_params: Dict[str, Any],
+    ensemble: Union[int, str],
+    df: pd.DataFrame,
+) -> Optional[Dict[str, Any]]:
+    """
+    The latest model of a county, if it can be updated rather than refit.
+
+    It can if it was fit with the same params, ensemble and features
+    to data that has since had rows for later years appended to it
+    and is otherwise unchanged, as far as the row counts show.
+    """
+    if latest is None:
+        reason = "there is no previous model"
+    elif (
+        latest["params"] != xgb_params
+        or latest["ensemble"] != str(ensemble)
+        or latest["columns"] != list(X.columns)
+    ):
+        reason = "the params, ensemble or features have changed"
+    elif (df["year"] <= latest["max_year"]).sum() != latest["rows"]:
+        reason = "the rows for earlier years have changed"
+    elif df["year"].max() <= latest["max_year"]:
+        reason = "no rows have been appended"
+    else:
+        return latest
+
+    logger.info(f"Refitting rather than updating, since {reason}.")
+    return None
+
+
+def plot_variant(
+    df: pd.DataFrame,
+    x_cols: List[str],
+    y_col: str,
+    parameters_path: Path,
+    output_path: Path,
+    *,
+    fips: str,
+    county_name: str,
+    bucket_path: Optional[Path] = None,
+    model_cache_dir: Optional[Path] = None,
+    ensemble_size: int = 50,
+    adaptive: bool = False,
+    k_min: int = 10,
+    k_batch: int = 5,
+    tolerance: float = 0.02,
+    workers: int = 1,
+    threads: Optional[int] = None,
+    linreg: bool = False,
+    incremental: bool = False,
+    update_rounds: Optional[int] = None,
+    update_report: Optional[Path] = None,
+) -> bool:
+    """
+    Fit the impact model of one population and y column of a county and plot it.
+
+    Parameters
+    ----------
+    df
+        The county's data, from :py:func:`evlcharts.variants.load_county`.
+    x_cols
+        The X columns of the population.
+    incremental
+        If the county's latest model in the model cache was fit to the
+        same data less some later years, continue boosting it on the
+        new years rather than refitting it. See
+        :py:meth:`evlcharts.ensemble.ParallelXGBoostImpactModel.update`.
+    update_rounds
+        Rounds to add to each estimator when updating. Defaults to
+        the share of `n_estimators` the new rows are of all rows.
+    update_report
+        Where to write how long an update took compared to the last
+        full fit and how much it moved the bucketed impacts.
+
+    Returns
+    -------
+        `False` if there was no data left for the county after
+        removing rows with missing values, otherwise `True`.
+    """
+    df = df[x_cols + [y_col, var.VARIABLE_TOTAL_RENTERS, "year"]]
+
+    df = df.dropna(subset=list(x_cols + [y_col]))
+
+    # Without data there are no params either, since optimize skips it.
+    if len(df.index) == 0:
+        logger.warning(f"After removing nan from X and {y_col}, no data is left.")
+        return False
+
+    with open(parameters_path) as f:
+        result = yaml.full_load(f)
+
+    xgb_params = result["xgb"]["params"]
+    linreg_coefs = result["linreg"]["coefficients"]
+    linreg_intercept = result["linreg"]["intercept"]
+
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    X = df[list(x_cols)]
+    y = df[y_col]
+    w = df[var.VARIABLE_TOTAL_RENTERS]
+
+    k = ensemble_size
+    seed = 0x3423CDF1
+
+    if adaptive:
+        ensemble = f"adaptive:{k_min}:{k}:{k_batch}:{tolerance}"
+    else:
+        ensemble = k
+
+    if model_cache_dir is not None:
+        model_cache = ModelCache(model_cache_dir)
+        key = model_key(X, y, w, xgb_params, ensemble, seed)
+        impact_model = model_cache.load(key)
+    else:
+        model_cache = None
+        impact_model = None
+
+    latest = None
+
+    if impact_model is None and incremental and model_cache is not None:
+        # Updated models are kept apart from refit ones, so only
+        # incremental runs ever use them. A full refit keeps the
+        # normal key, so later runs without --incremental find it.
+        incremental_key = model_key(
+            X, y, w, xgb_params, f"{ensemble}:incremental", seed
+        )
+        impact_model = model_cache.load(incremental_key)
+
+        if impact_model is None:
+            latest = _updatable(model_cache.latest(fips), X, xgb_params, ensemble, df)
+
+        if impact_model is not None or latest is not None:
+            key = incremental_key
+
+    start = time.perf_counter()
+
+    if latest is not None:
+        impact_model = model_cache.load(latest["key"])
+
+        if impact_model is None:
+            logger.info(f"The latest model for {fips} is gone; refitting.")
+            latest = None
+            key = model_key(X, y, w, xgb_params, ensemble, seed)
+
+    updated = latest is not None
+    fitted = impact_model is None
+
+    # Cached models were pickled with the workers of the run that fit them.
+    if isinstance(impact_model, ParallelXGBoostImpactModel):
+        impact_model.set_workers(workers, threads)
+
+    if updated:
+        df_bucketed_before = bucketed_impacts(impact_model, impact_model._X_fit)
+
+        appended = df["year"] > latest["max_year"]
+        if update_rounds is None:
+            update_rounds = max(
+                1,
+                round(xgb_params.get("n_estimators", 100) * appended.mean()),
+            )
+
+        impact_model.update(X, y, w, rows=appended, rounds=update_rounds)
+    elif fitted and adaptive:
+        impact_model = AdaptiveXGBoostImpactModel(
+            k_min=k_min,
+            k_max=k,
+            batch=k_batch,
+            tolerance=tolerance,
+            workers=workers,
+            threads=threads,
+            random_state=seed,
+            estimator_kwargs=xgb_params,
+        )
+        impact_model.fit(X, y, sample_weight=w)
+    elif fitted:
+        impact_model = ParallelXGBoostImpactModel(
+            workers=workers,
+            threads=threads,
+            ensemble_size=k,
+            random_state=seed,
+            estimator_kwargs=xgb_params,
+        )
+        impact_model.fit(X, y, sample_weight=w)
+
+    if fitted or updated:
+        # Time the impacts too, since an update has to recompute all
+        # of them, just as a refit does.
+        impact_model.impact(X)
+        seconds = time.perf_counter() - start
+
+    plot_impact_chars(
+        impact_model,
+        X,
+        y_col,
+        output_path,
+        county_name=county_name,
+        k=impact_model.k,
+        seed=seed,
+        linreg=linreg,
+        linreg_coefs=linreg_coefs,
+        linreg_intercept=linreg_intercept,
+    )
+
+    # Plotting computed the impacts, so they are saved with the model.
+    if model_cache is not None and (fitted or updated):
+        model_cache.save(key, impact_model)
+
+        if fitted:
+            full_seconds = seconds
+            full_rows = len(df.index)
+        else:
+            full_seconds = latest["full_seconds"]
+            full_rows = latest["full_rows"]
+
+        model_cache.set_latest(
+            fips,
+            {
+                "key": key,
+                "params": xgb_params,
+                "ensemble": str(ensemble),
+                "columns": list(X.columns),
+                "rows": len(df.index),
+                "max_year": int(df["year"].max()),
+                "seconds": seconds,
+                "full_seconds": full_seconds,
+                "full_rows": full_rows,
+                "updates": latest["updates"] + 1 if updated else 0,
+            },
+        )
+
+    if updated:
+        # Impacts, which take most of the time, grow with the rows, so
+        # scale the last full fit to what it would take on these.
+        full_seconds = full_seconds * len(df.index) / full_rows
+
+        changes = bucket_changes(df_bucketed_before, bucketed_impacts(impact_model, X))
+
+        report = {
+            "fips": fips,
+            "y_col": y_col,
+            "previous_rows": latest["rows"],
+            "appended_rows": int(appended.sum()),
+            "rounds": update_rounds,
+            "updates": latest["updates"] + 1,
+            "seconds": round(seconds, 3),
+            "full_seconds": round(full_seconds, 3),
+            "seconds_saved": round(full_seconds - seconds, 3),
+            "chart_change": max(changes.values()),
+            "feature_changes": changes,
+        }
+
+        logger.info(
+            f"Updated the model in {seconds:.1f}s rather than refitting it in "
+            f"about {full_seconds:.1f}s. Bucketed impacts moved by up to "
+            f"{report['chart_change']:.1%} of their range."
+        )
+
+        if update_report is not None:
+            update_report.parent.mkdir(parents=True, exist_ok=True)
+            with open(update_report, "w") as f:
+                yaml.dump(report, f, sort_keys=False)
+
+    if bucket_path is not None:
+        logging.info("Computing bucketed impact.")
+
+        df_bucketed_impact = bucketed_impacts(impact_model, X)
+
+        bucket_path.parent.mkdir(parents=True, exist_ok=True)
+        loader.write_data(df_bucketed_impact, bucket_path)
+
+    return True
+
+
 def main():
     parser = LoggingArgumentParser(logger)
 
     parser.add_argument("--dry-run", action=BooleanOptionalAction)
     parser.add_argument(
-        "-o", "--output", required=True, type=str, help="Output yaml file."
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="Output directory. With several populations or y columns, "
+        "a template with {population} and {y} in it.",
     )
     parser.add_argument(
         "-v", "--vintage", default=2018, type=int, help="Year to get data."
@@ -126,7 +498,7 @@ def main():
         "--parameters",
         required=True,
         type=str,
-        help="Model parameters (from optimize.py).",
+        help="Model parameters (from optimize.py). A template like --output.",
     )
 
     parser.add_argument(
@@ -137,97 +509,190 @@ def main():
         "-y",
         "--y-column",
         type=str,
+        nargs="+",
         choices=["filing_rate", "threatened_rate", "judgement_rate"],
-        default="filing_rate",
-        help="What variable are we trying to predict?",
+        default=["filing_rate"],
+        help="What variable are we trying to predict? Give several to "
+        "plot each of them from one read of the data.",
     )
 
     parser.add_argument(
         "--population",
         type=str,
+        nargs="+",
         choices=["all", "renters"],
-        default="renters",
+        default=["renters"],
         required=True,
-        help="What do we base the population metrics on?",
+        help="What do we base the population metrics on? Give several to "
+        "plot each of them from one read of the data.",
     )
 
     parser.add_argument("--linreg", action="store_true")
 
-    parser.add_argument("--bucket", help="Where to write bucket impact analysis.")
-
-    parser.add_argument("data", help="Input data file. Typically from select.py.")
-
-    args = parser.parse_args()
+    parser.add_argument(
+        "--bucket",
+        help="Where to write bucket impact analysis. The format (csv, parquet "
+        "or feather) follows the suffix. A template like --output.",
+    )
 
-    fips = args.fips
-    year = args.vintage
+    parser.add_argument(
+        "--model-cache",
+        type=str,
+        help="Directory of fitted impact models to reuse instead of refitting. "
+        "A template like --output.",
+    )
 
-    county_name = var.cofips_name(fips, year)
+    parser.add_argument(
+        "--county-names",
+        type=str,
+        nargs="*",
+        default=[],
+        help="County name files (from countynames.py) to look the county name up in.",
+    )
 
-    data_path = Path(args.data)
-    output_path = Path(args.output)
+    parser.add_argument("--name-cache", type=str, help="Cache file for county names.")
 
-    renters_only = args.population == "renters"
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Never download the county name. Use the FIPS code if it is not known.",
+    )
 
-    df = pd.read_csv(
-        data_path, header=0, dtype={"STATE": str, "COUNTY": str, "TRACT": str}
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Fit and explain this many ensemble members at once.",
     )
 
-    with open(args.parameters) as f:
-        result = yaml.full_load(f)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Cap on the total threads used by all workers. Defaults to all cores.",
+    )
 
-    xgb_params = result["xgb"]["params"]
-    linreg_coefs = result["linreg"]["coefficients"]
-    linreg_intercept = result["linreg"]["intercept"]
+    parser.add_argument(
+        "-k",
+        "--ensemble-size",
+        type=_positive_int,
+        default=50,
+        help="Estimators in the ensemble. With --adaptive, the most to use.",
+    )
 
-    x_cols = var.x_cols(df, renters_only)
-    y_col = args.y_column
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Add estimators in batches until the mean impacts settle.",
+    )
 
-    df = df.dropna(subset=list(x_cols + [y_col]))
+    parser.add_argument(
+        "--k-min",
+        type=_positive_int,
+        default=10,
+        help="With --adaptive, the fewest estimators to use.",
+    )
 
-    output_path.mkdir(parents=True, exist_ok=True)
+    parser.add_argument(
+        "--k-batch",
+        type=_positive_int,
+        default=5,
+        help="With --adaptive, how many estimators to add at a time.",
+    )
 
-    X = df[list(x_cols)]
-    y = df[y_col]
-    w = df[var.VARIABLE_TOTAL_RENTERS]
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="With --adaptive, stop once a batch moves no mean impact by more "
+        "than this fraction of the range of all of the mean impacts.",
+    )
 
-    k = 50
-    seed = 0x3423CDF1
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Continue boosting the county's latest cached model on newly "
+        "appended years, if that is all that changed, rather than refitting.",
+    )
 
-    impact_model = XGBoostImpactModel(
-        ensemble_size=k, random_state=seed, estimator_kwargs=xgb_params
+    parser.add_argument(
+        "--update-rounds",
+        type=int,
+        help="With --incremental, rounds to add to each estimator. Defaults to "
+        "n_estimators times the share of the rows that are new.",
     )
-    impact_model.fit(X, y, sample_weight=w)
 
-    plot_impact_chars(
-        impact_model,
-        X,
-        y_col,
-        output_path,
-        county_name=county_name,
-        k=k,
-        seed=seed,
-        linreg=args.linreg,
-        linreg_coefs=linreg_coefs,
-        linreg_intercept=linreg_intercept,
+    parser.add_argument(
+        "--update-report",
+        help="With --incremental, a YAML file to write the time saved and how "
+        "much the bucketed impacts moved to. A template like --output.",
     )
 
-    if args.bucket is not None:
-        logging.info("Computing bucketed impact.")
+    parser.add_argument("data", help="Input data file. Typically from select.py.")
 
-        df_bucketed_impact = pd.concat(
-            (
-                impact_model.bucketed_impact(X, feature)[["impact"]].rename(
-                    {"impact": feature}, axis="columns"
-                )
-                for feature in x_cols
-            ),
-            axis="columns",
-        )
+    args = parser.parse_args()
+
+    if args.incremental and args.model_cache is None:
+        parser.error("--incremental needs --model-cache to find the previous model.")
+
+    fips = args.fips
+    year = args.vintage
+
+    county_names = CountyNames(
+        year,
+        cache_path=Path(args.name_cache) if args.name_cache is not None else None,
+        names_files=[Path(names_file) for names_file in args.county_names],
+        offline=args.offline,
+    )
+    county_name = county_names.name(fips)
+
+    data_path = Path(args.data)
 
-        bucketed_path = Path(args.bucket)
-        bucketed_path.parent.mkdir(parents=True, exist_ok=True)
-        df_bucketed_impact.to_csv(bucketed_path, index=False)
+    variants = all_variants(args.population, args.y_column)
+
+    try:
+        output_paths = variant_paths(args.output, variants)
+        parameters_paths = variant_paths(args.parameters, variants)
+        bucket_paths = optional_variant_paths(args.bucket, variants)
+        model_cache_dirs = optional_variant_paths(args.model_cache, variants)
+        update_reports = optional_variant_paths(args.update_report, variants)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Every variant is fit from the one read of the data.
+    df, x_cols = load_county(data_path, fips, args.population, args.y_column)
+
+    no_data = []
+
+    for variant in variants:
+        population, y_col = variant
+
+        if not plot_variant(
+            df,
+            x_cols[population],
+            y_col,
+            parameters_paths[variant],
+            output_paths[variant],
+            fips=fips,
+            county_name=county_name,
+            bucket_path=bucket_paths[variant],
+            model_cache_dir=model_cache_dirs[variant],
+            ensemble_size=args.ensemble_size,
+            adaptive=args.adaptive,
+            k_min=args.k_min,
+            k_batch=args.k_batch,
+            tolerance=args.tolerance,
+            workers=args.workers,
+            threads=args.threads,
+            linreg=args.linreg,
+            incremental=args.incremental,
+            update_rounds=args.update_rounds,
+            update_report=update_reports[variant],
+        ):
+            no_data.append(f"{population} {y_col}")
+
+    # With several variants, some of them having no data is expected.
+    if no_data and len(variants) == 1:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,76 +1,339 @@
+"""
+Rank counties by how much each feature's impact varies across its buckets.
+
+The bucket files written by `plot.py --bucket` are combined, the gap
+between the highest and lowest bucket impact of every feature in every
+county is computed in one pass, and the gaps are ranked and stored in
+an indexed SQLite file that can be queried for the top or bottom
+counties by feature, state or county.
+"""
+
 import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, List, Optional
 
 import pandas as pd
 
+import evlcharts.loader as loader
 from evlcharts.loggingargparser import LoggingArgumentParser
 
 logger = logging.getLogger(__name__)
 
 
+ID_COLUMNS = ["COUNTY", "DECILE", "K"]
+
+
 def load_county(county_path: Path) -> pd.DataFrame:
-    county_fips = county_path.stem
+    """
+    Load a county's bucket file.
+
+    A combined file previously written by this module, which already
+    has a `COUNTY` column, can be loaded the same way.
+    """
+    df = loader.read_data(county_path)
+
+    # Older CSV files number the deciles only by their row.
+    if "DECILE" not in df.columns:
+        df = df.reset_index().rename({"index": "DECILE"}, axis="columns")
+
+    # Before ensembles could be adaptive they all had 50 estimators.
+    if "K" not in df.columns:
+        df["K"] = 50
+
+    if "COUNTY" not in df.columns:
+        df["COUNTY"] = county_path.stem
+    else:
+        df["COUNTY"] = df["COUNTY"].astype(str).str.zfill(5)
+
+    feature_cols = [col for col in df.columns if col not in ID_COLUMNS]
+
+    return df[ID_COLUMNS + feature_cols]
+
+
+def load_counties(county_paths: Iterable[Path], workers: int) -> pd.DataFrame:
+    """Load many bucket files in a pool of threads."""
+    county_paths = list(county_paths)
+
+    logger.info(f"Loading {len(county_paths)} bucket files with {workers} threads.")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return pd.concat(executor.map(load_county, county_paths), ignore_index=True)
+
 
-    logger.info(f"Processing county {county_fips}")
+def gap_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The gap between the highest and lowest bucket impact of each feature.
 
-    df = (
-        pd.read_csv(county_path)
+    Returns
+    -------
+        A data frame with a row for every county and feature and columns
+        `COUNTY`, `STATE`, `FEATURE`, `HIGH`, `LOW`, `GAP` and `RANK`,
+        where `RANK` is 1 for the county with the largest gap for the
+        feature.
+    """
+    feature_cols = [col for col in df.columns if col not in ID_COLUMNS]
+
+    # One pass computes the high and low of every feature.
+    df_high_low = df.groupby("COUNTY")[feature_cols].agg(["max", "min"])
+
+    df_gap = (
+        df_high_low.rename_axis(["FEATURE", None], axis="columns")
+        .stack("FEATURE")
+        .rename({"max": "HIGH", "min": "LOW"}, axis="columns")
         .reset_index()
-        .rename({"index": "DECILE"}, axis="columns")
     )
-    df["COUNTY"] = county_fips
 
-    feature_cols = [col for col in df.columns if col not in ["COUNTY", "DECILE"]]
-    df = df[["COUNTY", "DECILE"] + feature_cols]
+    df_gap["GAP"] = df_gap["HIGH"] - df_gap["LOW"]
+    df_gap["STATE"] = df_gap["COUNTY"].str[:2]
+    df_gap["RANK"] = (
+        df_gap.groupby("FEATURE")["GAP"]
+        .rank(method="first", ascending=False)
+        .astype(int)
+    )
 
-    return df
+    return df_gap[["COUNTY", "STATE", "FEATURE", "HIGH", "LOW", "GAP", "RANK"]]
 
 
-def large_impact(df: pd.DataFrame) -> pd.DataFrame:
-    feature_cols = [col for col in df.columns if col not in ["COUNTY", "DECILE"]]
+class RankingStore:
+    """
+    A SQLite store of bucket impact gaps.
 
-    df_high = df.groupby("COUNTY")[feature_cols].max()
-    df_low = df.groupby("COUNTY")[feature_cols].min()
-    df_gap = df_high - df_low
+    There is one row per population, y column, feature and county.
+    Rankings for different populations and y columns can share one
+    store.
+    """
 
-    df_large = pd.concat(
-        df_gap[df_gap[feature] > 5.0].nlargest(10, feature) for feature in feature_cols
-    )
+    def __init__(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS gaps ("
+            "population TEXT, y_col TEXT, feature TEXT, county TEXT, state TEXT, "
+            "high REAL, low REAL, gap REAL, rank INTEGER, "
+            "PRIMARY KEY (population, y_col, feature, county))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS gaps_feature "
+            "ON gaps (population, y_col, feature, gap)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS gaps_state "
+            "ON gaps (population, y_col, state, feature)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS gaps_county ON gaps (population, y_col, county)"
+        )
+        self._connection.commit()
+
+    def put(self, df_gap: pd.DataFrame, *, population: str, y_col: str):
+        """Replace the gaps for a population and y column with those from :py:func:`gap_table`."""
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM gaps WHERE population = ? AND y_col = ?",
+                (population, y_col),
+            )
+            self._connection.executemany(
+                "INSERT INTO gaps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (population, y_col, *row)
+                    for row in df_gap[
+                        ["FEATURE", "COUNTY", "STATE", "HIGH", "LOW", "GAP", "RANK"]
+                    ].itertuples(index=False)
+                ),
+            )
+
+    def query(
+        self,
+        n: int,
+        *,
+        population: str,
+        y_col: str,
+        largest: bool = True,
+        features: Optional[List[str]] = None,
+        states: Optional[List[str]] = None,
+        counties: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        The `n` counties with the largest or smallest gaps for each feature.
 
-    large_fips = sorted(list(df_large.index.unique()))
+        Parameters
+        ----------
+        n
+            How many counties to return for each feature.
+        population
+            The population the gaps were computed for.
+        y_col
+            The y column the gaps were computed for.
+        largest
+            If `True`, the largest gaps, otherwise the smallest.
+        features
+            If not `None`, only these features.
+        states
+            If not `None`, only counties in these 2 digit states.
+        counties
+            If not `None`, only these SSCCC counties.
 
-    print(", ".join(large_fips))
+        Returns
+        -------
+            A data frame like that of :py:func:`gap_table`, ordered by
+            feature and then gap. `RANK` is still the rank among all
+            of the counties.
+        """
+        conditions = ["population = ?", "y_col = ?"]
+        params: List = [population, y_col]
 
-    if True:
-        print("LARGEST")
-        print(df_gap.nlargest(10, "B25119_003E_2018"))
-        print(df_gap.nlargest(10, "frac_B25003A_003E"))
-        print(df_gap.nlargest(10, "frac_B25003B_003E"))
+        for column, values in [
+            ("feature", features),
+            ("state", states),
+            ("county", counties),
+        ]:
+            if values is not None:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
 
-        print("SMALLEST")
-        print(df_gap.nsmallest(10, "B25119_003E_2018"))
-        print(df_gap.nsmallest(10, "frac_B25003A_003E"))
-        print(df_gap.nsmallest(10, "frac_B25003B_003E"))
+        order = "DESC" if largest else "ASC"
+
+        return pd.read_sql_query(
+            "SELECT county AS COUNTY, state AS STATE, feature AS FEATURE, "
+            "high AS HIGH, low AS LOW, gap AS GAP, rank AS RANK FROM ("
+            "SELECT *, ROW_NUMBER() OVER "
+            f"(PARTITION BY feature ORDER BY gap {order}, county) AS position "
+            f"FROM gaps WHERE {' AND '.join(conditions)}"
+            ") WHERE position <= ? ORDER BY feature, position",
+            self._connection,
+            params=params + [n],
+        )
+
+    def close(self):
+        self._connection.close()
 
 
 def main():
     parser = LoggingArgumentParser(logger)
 
     parser.add_argument(
-        "-o", "--output", required=True, type=str, help="Output yaml file."
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="Output file. When ranking, the combined buckets of every county. "
+        "When querying, the matching gaps. The format follows the suffix.",
+    )
+
+    parser.add_argument(
+        "--ranking",
+        required=True,
+        type=str,
+        help="SQLite file to store the ranked gaps in or query them from.",
+    )
+
+    parser.add_argument(
+        "--population",
+        type=str,
+        choices=["all", "renters"],
+        default="renters",
+        help="What population the buckets were computed for.",
+    )
+
+    parser.add_argument(
+        "-y",
+        "--y-column",
+        type=str,
+        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        default="filing_rate",
+        help="What variable the buckets were computed for.",
+    )
+
+    parser.add_argument(
+        "--gaps", type=str, help="Also write the full gap table to this file."
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Threads to read bucket files with. Defaults to the number of cores.",
+    )
+
+    query_group = parser.add_mutually_exclusive_group()
+    query_group.add_argument(
+        "--top",
+        type=int,
+        help="Query the counties with the N largest gaps for each feature.",
+    )
+    query_group.add_argument(
+        "--bottom",
+        type=int,
+        help="Query the counties with the N smallest gaps for each feature.",
+    )
+
+    parser.add_argument("--feature", nargs="+", help="Only query these features.")
+    parser.add_argument("--state", nargs="+", help="Only query these states.")
+    parser.add_argument("--county", nargs="+", help="Only query these SSCCC counties.")
+
+    parser.add_argument(
+        "counties",
+        nargs="*",
+        help="Bucket files from plot.py, or a combined file from a previous run.",
     )
-    parser.add_argument("counties", nargs="+", help="Files created by rankbucket.py.")
 
     args = parser.parse_args()
 
     output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    df_all_counties = pd.concat(load_county(Path(county)) for county in args.counties)
+    store = RankingStore(Path(args.ranking))
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if args.top is not None or args.bottom is not None:
+        if args.counties:
+            parser.error("Bucket files cannot be given with --top or --bottom.")
+
+        df_query = store.query(
+            args.top if args.top is not None else args.bottom,
+            population=args.population,
+            y_col=args.y_column,
+            largest=args.top is not None,
+            features=args.feature,
+            states=args.state,
+            counties=args.county,
+        )
+        store.close()
+
+        logger.info(f"Writing {len(df_query.index)} rows to `{output_path}`")
+        loader.write_data(df_query, output_path)
+        return
+
+    if not args.counties:
+        parser.error(
+            "Bucket files are required unless querying with --top or --bottom."
+        )
+
+    df_all_counties = load_counties(
+        (Path(county) for county in args.counties),
+        workers=args.workers if args.workers is not None else os.cpu_count() or 1,
+    )
+
+    df_gap = gap_table(df_all_counties)
+
+    logger.info(
+        f"Ranked {df_gap['COUNTY'].nunique()} counties on "
+        f"{df_gap['FEATURE'].nunique()} features."
+    )
+
+    store.put(df_gap, population=args.population, y_col=args.y_column)
+    store.close()
+
+    if args.gaps is not None:
+        gaps_path = Path(args.gaps)
+        gaps_path.parent.mkdir(parents=True, exist_ok=True)
+        loader.write_data(df_gap, gaps_path)
 
-    large_impact(df_all_counties)
-    df_all_counties.to_csv(output_path, index=False)
+    loader.write_data(df_all_counties, output_path)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ import jinja2
 import pandas as pd
 
 from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.results import ResultsStore
 
 logger = logging.getLogger(__name__)
 
@@ -16,12 +17,37 @@ def main():
     parser.add_argument(
         "-o", "--output-file", required=True, help="Output file for results."
     )
-    parser.add_argument(
+    scores_group = parser.add_mutually_exclusive_group(required=True)
+    scores_group.add_argument(
         "-c",
         "--county-file",
-        required=True,
         help="Top n list file we should render into template file.",
     )
+    scores_group.add_argument(
+        "--results",
+        help="Results store from optimize.py to read the scores from instead.",
+    )
+    parser.add_argument(
+        "--population",
+        type=str,
+        choices=["all", "renters"],
+        default="renters",
+        help="With --results, the population to read scores for.",
+    )
+    parser.add_argument(
+        "-y",
+        "--y-column",
+        type=str,
+        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        default="filing_rate",
+        help="With --results, the y column to read scores for.",
+    )
+    parser.add_argument(
+        "--fips",
+        type=str,
+        nargs="+",
+        help="With --results, only render these counties.",
+    )
     parser.add_argument(
         "-n",
         "--names",
@@ -37,9 +63,17 @@ def main():
     args = parser.parse_args()
 
     logger.info(f"Reading template from {args.template_file}")
-    logger.info(f"Reading sorted county score data from {args.county_file}")
 
-    df_all = pd.read_csv(args.county_file, dtype={"FIPS": str})
+    if args.results is not None:
+        logger.info(f"Reading county scores from {args.results}")
+        store = ResultsStore(Path(args.results))
+        df_all = store.scores(
+            population=args.population, y_col=args.y_column, fips=args.fips
+        )
+        store.close()
+    else:
+        logger.info(f"Reading sorted county score data from {args.county_file}")
+        df_all = pd.read_csv(args.county_file, dtype={"FIPS": str})
 
     if args.limit is not None:
         df_all = df_all.iloc[: args.limit]
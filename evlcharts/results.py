@@ -0,0 +1,201 @@
+"""A single indexed store of the results of optimizing every county."""
+
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import pandas as pd
+import yaml
+
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+class ResultsStore:
+    """
+    A SQLite store of optimization results.
+
+    There is one row per county, population and y column, holding
+    the cross validated target and score of the best xgboost params,
+    the params themselves, the linear model and the search timing.
+    Scores for every county can be read with a single query rather
+    than by parsing a params file per county.
+
+    Several processes can share one store, as they do when make runs
+    optimize with `-j`.
+    """
+
+    def __init__(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "fips TEXT, population TEXT, y_col TEXT, rows INTEGER, "
+            "target REAL, score REAL, params TEXT, "
+            "linreg_score REAL, linreg_coefficients TEXT, linreg_intercept REAL, "
+            "search TEXT, strategy TEXT, fits INTEGER, wall_time REAL, "
+            "PRIMARY KEY (population, y_col, fips))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_score "
+            "ON results (population, y_col, score)"
+        )
+        self._connection.commit()
+
+    def put(self, result: Dict[str, Any], *, population: str, y_col: str):
+        """Store a county's result, in the form optimize writes to its params file."""
+        xgb = result["xgb"]
+        linreg = result["linreg"]
+        search = xgb.get("search", {})
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO results VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                result["fips"],
+                population,
+                y_col,
+                result.get("rows"),
+                xgb["target"],
+                xgb["score"],
+                json.dumps(xgb["params"], sort_keys=True),
+                linreg["score"],
+                json.dumps(linreg["coefficients"]),
+                linreg["intercept"],
+                json.dumps(search, sort_keys=True),
+                search.get("strategy"),
+                search.get("fits"),
+                search.get("wall_time"),
+            ),
+        )
+        self._connection.commit()
+
+    def get(
+        self, fips: str, *, population: str, y_col: str
+    ) -> Optional[Dict[str, Any]]:
+        """A county's result, in the same form as its params file, or `None`."""
+        row = self._connection.execute(
+            "SELECT rows, target, score, params, linreg_score, linreg_coefficients, "
+            "linreg_intercept, search FROM results "
+            "WHERE population = ? AND y_col = ? AND fips = ?",
+            (population, y_col, fips),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        (
+            rows,
+            target,
+            score,
+            params,
+            linreg_score,
+            linreg_coefficients,
+            linreg_intercept,
+            search,
+        ) = row
+
+        return {
+            "fips": fips,
+            "rows": rows,
+            "linreg": {
+                "coefficients": json.loads(linreg_coefficients),
+                "intercept": linreg_intercept,
+                "score": linreg_score,
+            },
+            "xgb": {
+                "params": json.loads(params),
+                "target": target,
+                "score": score,
+                "search": json.loads(search),
+            },
+        }
+
+    def scores(
+        self,
+        *,
+        population: str,
+        y_col: str,
+        fips: Optional[Iterable[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        The scores of every county, best first.
+
+        Returns
+        -------
+            A data frame with `FIPS` and `SCORE` columns, like the
+            output of :py:mod:`evlcharts.topscore`.
+        """
+        df_scores = pd.read_sql_query(
+            "SELECT fips AS FIPS, score AS SCORE FROM results "
+            "WHERE population = ? AND y_col = ? ORDER BY score DESC",
+            self._connection,
+            params=(population, y_col),
+        )
+
+        if fips is not None:
+            fips = list(fips)
+            missing = set(fips) - set(df_scores["FIPS"])
+            if missing:
+                logger.warning(
+                    f"No results for {len(missing)} counties: {' '.join(sorted(missing))}"
+                )
+            df_scores = df_scores[df_scores["FIPS"].isin(fips)].reset_index(drop=True)
+
+        return df_scores
+
+    def close(self):
+        self._connection.close()
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "-o", "--output", required=True, type=str, help="Results store to import into."
+    )
+
+    parser.add_argument(
+        "--population",
+        type=str,
+        choices=["all", "renters"],
+        default="renters",
+        help="What population the params were optimized for.",
+    )
+
+    parser.add_argument(
+        "-y",
+        "--y-column",
+        type=str,
+        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        default="filing_rate",
+        help="What variable the params were optimized to predict.",
+    )
+
+    parser.add_argument(
+        "params", nargs="+", help="Parameter files from optimize.py to import."
+    )
+
+    args = parser.parse_args()
+
+    store = ResultsStore(Path(args.output))
+
+    for params_path in args.params:
+        logger.info(f"Importing `{params_path}`")
+
+        with open(params_path) as f:
+            result = yaml.full_load(f)
+
+        store.put(result, population=args.population, y_col=args.y_column)
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,104 @@
 import logging
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 import pandas as pd
 
+import evlcharts.loader as loader
 import evlcharts.variables as var
+from evlcharts.filterfips import add_counts, county_counts, write_cache
 from evlcharts.loggingargparser import LoggingArgumentParser
 
 logger = logging.getLogger(__name__)
 
 
+def split_counties(
+    df: pd.DataFrame, fips_codes: Iterable[str]
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Split the joined data into one data frame per county.
+
+    The data is grouped by state and county once, so the cost
+    does not grow with the number of counties requested. Counties
+    with no data produce an empty data frame with all the columns.
+    """
+    # There are a handful of outliers where median income is
+    # over $250,000. The Census Bureau codes these as 250,001.
+    # We filter them out.
+    df = df[df[var.MEDIAN_HOUSEHOLD_INCOME_FOR_RENTERS] <= 250_000]
+
+    county_rows = df.groupby(["STATE", "COUNTY"], sort=False).indices
+
+    for fips in fips_codes:
+        state = fips[:2]
+        county = fips[2:]
+
+        rows = county_rows.get((state, county), [])
+
+        yield fips, df.iloc[rows]
+
+
+def stream_counties(
+    input_path: Path,
+    output_path: Path,
+    fips_codes: Iterable[str],
+    file_format: str,
+    *,
+    chunksize: int,
+    counts_cache: Optional[Path] = None,
+):
+    """
+    Split the joined data into county files a chunk at a time.
+
+    Each chunk of the input is split with :py:func:`split_counties`
+    and its rows are appended to the files of their counties, so
+    memory use is bounded by the chunk size rather than the size of
+    the input. Counties with no data get a file with just a header.
+
+    If `counts_cache` is given, the per-county counts that filterfips
+    uses are gathered in the same pass and written there.
+    """
+    fips_codes = list(fips_codes)
+
+    writers: Dict[str, loader.ChunkWriter] = {}
+    counts: Dict[str, Dict[str, int]] = {}
+    df_empty = None
+
+    try:
+        for df_chunk in loader.read_chunks(input_path, chunksize=chunksize):
+            if counts_cache is not None:
+                add_counts(counts, county_counts(df_chunk))
+
+            if df_empty is None:
+                df_empty = df_chunk.iloc[:0]
+
+            for fips, df_county in split_counties(df_chunk, fips_codes):
+                if len(df_county.index) == 0:
+                    continue
+
+                if fips not in writers:
+                    writers[fips] = loader.ChunkWriter(
+                        output_path / f"{fips}.{file_format}"
+                    )
+                writers[fips].write(df_county)
+
+        for fips in fips_codes:
+            if fips not in writers and df_empty is not None:
+                writers[fips] = loader.ChunkWriter(
+                    output_path / f"{fips}.{file_format}"
+                )
+                writers[fips].write(df_empty)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for fips, writer in writers.items():
+        logger.info(f"Wrote {writer.rows} rows for {fips}")
+
+    if counts_cache is not None:
+        write_cache(counts_cache, input_path, counts)
+
+
 def main():
     parser = LoggingArgumentParser(logger)
 
@@ -16,41 +106,69 @@ def main():
         "--fips",
         type=str,
         nargs="+",
+        required=True,
         help="Provide this as SSCCC for the state and county.",
     )
 
-    parser.add_argument("-o", "--output", required=True, type=str, help="Output file.")
+    parser.add_argument(
+        "-o", "--output", required=True, type=str, help="Output directory."
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet", "feather"],
+        default="csv",
+        help="Format of the county output files.",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Stream the input this many rows at a time, so memory use "
+        "does not grow with the size of the input.",
+    )
+
+    parser.add_argument(
+        "--counts-cache",
+        type=str,
+        help="Also write the per-county counts that filterfips uses here, "
+        "so it doesn't have to read the input again.",
+    )
 
-    parser.add_argument("input", help="Input file. The output of join.py.")
+    parser.add_argument(
+        "input",
+        help="Input file or partitioned dataset. The output of join.py or columnar.py.",
+    )
 
     args = parser.parse_args()
 
     input_path = Path(args.input)
     output_path = Path(args.output)
 
-    logger.info(f"Reading input file `{input_path}`")
-
-    df = pd.read_csv(
-        input_path, header=0, dtype={"STATE": str, "COUNTY": str, "TRACT": str}
-    )
-
     output_path.mkdir(parents=True, exist_ok=True)
 
-    for fips in args.fips:
-        state = fips[:2]
-        county = fips[2:]
-
-        # There are a handful of outliers where median income is
-        # over $250,000. The Census Bureau codes these as 250,001.
-        # We filter them out.
-        df_county = df[
-            (df["STATE"] == state)
-            & (df["COUNTY"] == county)
-            & (df[var.MEDIAN_HOUSEHOLD_INCOME_FOR_RENTERS] <= 250_000)
-        ]
-
-        logger.info(f"Writing to output file `{output_path}`")
-        df_county.to_csv(output_path / f"{fips}.csv", index=False)
+    if args.chunksize is not None:
+        stream_counties(
+            input_path,
+            output_path,
+            args.fips,
+            args.format,
+            chunksize=args.chunksize,
+            counts_cache=Path(args.counts_cache)
+            if args.counts_cache is not None
+            else None,
+        )
+        return
+
+    df = loader.read_data(input_path)
+
+    if args.counts_cache is not None:
+        write_cache(Path(args.counts_cache), input_path, county_counts(df))
+
+    for fips, df_county in split_counties(df, args.fips):
+        county_path = output_path / f"{fips}.{args.format}"
+        logger.info(f"Writing {len(df_county.index)} rows to `{county_path}`")
+        loader.write_data(df_county, county_path)
 
 
 if __name__ == "__main__":
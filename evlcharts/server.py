@@ -0,0 +1,268 @@
+"""
+A server that runs evlcharts commands without paying for interpreter
+startup and imports on every one.
+
+The server imports pandas, xgboost, shap, matplotlib, geopandas and the
+evlcharts modules once. Each request then runs in a forked child of
+the server, exactly as `python -m <module> <args>` would, in the
+client's working directory and environment and with the client's
+stdin, stdout and stderr, which are passed over the socket. Forking
+keeps requests isolated from one another and lets several run at once,
+as they do under `make -j`.
+
+Requests come from :py:mod:`evlcharts.client`.
+"""
+
+import importlib
+import json
+import logging
+import os
+import runpy
+import socket
+import socketserver
+import struct
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from evlcharts.loggingargparser import LoggingArgumentParser
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SOCKET = f"/tmp/evlcharts-{os.getuid()}.sock"
+
+# Third party modules that are slow to import, and the evlcharts
+# modules make runs, which import the rest.
+PRELOAD_MODULES = [
+    "numpy",
+    "pandas",
+    "pyarrow.dataset",
+    "sklearn.linear_model",
+    "xgboost",
+    "shap",
+    "impactchart.model",
+    "matplotlib.pyplot",
+    "geopandas",
+    "evlcharts.filterfips",
+    "evlcharts.select",
+    "evlcharts.columnar",
+    "evlcharts.optimize",
+    "evlcharts.topscore",
+    "evlcharts.plot",
+    "evlcharts.rankbuckets",
+    "evlcharts.maps",
+    "evlcharts.countynames",
+    "evlcharts.rendersite",
+    "evlcharts.checksite",
+]
+
+# Requests are a length prefixed JSON object, sent along with the
+# client's stdin, stdout and stderr.
+_LENGTH = struct.Struct("!I")
+_STDIO_FDS = 3
+
+
+def send_request(sock: socket.socket, request: Dict[str, Any], fds: List[int]):
+    payload = json.dumps(request).encode()
+    socket.send_fds(sock, [_LENGTH.pack(len(payload)) + payload], fds)
+
+
+def receive_request(sock: socket.socket) -> Tuple[Dict[str, Any], List[int]]:
+    data, fds, _, _ = socket.recv_fds(sock, 1 << 16, _STDIO_FDS)
+
+    prefix = _LENGTH.size
+
+    if len(data) < prefix:
+        raise ConnectionError("Incomplete request.")
+
+    (length,) = _LENGTH.unpack(data[:prefix])
+    payload = data[prefix:]
+
+    while len(payload) < length:
+        chunk = sock.recv(length - len(payload))
+        if not chunk:
+            raise ConnectionError("Incomplete request.")
+        payload += chunk
+
+    return json.loads(payload), fds
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def preload(modules: Iterable[str]):
+    """Import modules so that forked requests find them already loaded."""
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"Unable to preload {module}: {e}")
+            continue
+        logger.info(f"Preloaded {module} in {time.perf_counter() - start:.2f}s.")
+
+
+def run_module(module: str, argv: List[str]) -> int:
+    """
+    Run a module as `python -m` would and return its exit status.
+
+    Modules with a `main()` function, which is all of the evlcharts
+    commands, have it called directly, so that an already imported
+    module is not executed a second time.
+    """
+    try:
+        command = importlib.import_module(module)
+        sys.argv = [command.__file__] + argv
+
+        if hasattr(command, "main"):
+            command.main()
+        else:
+            runpy.run_module(module, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+
+def reset_logging():
+    # The command configures logging itself, as it would in a new
+    # process, so it should not inherit the server's handlers.
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+
+    for other in logging.Logger.manager.loggerDict.values():
+        if isinstance(other, logging.Logger):
+            other.setLevel(logging.NOTSET)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # We are in a child forked for this request.
+        request, fds = receive_request(self.request)
+
+        if len(fds) != _STDIO_FDS:
+            raise ConnectionError(f"Expected {_STDIO_FDS} file descriptors.")
+
+        # Let the client forward signals, e.g. when make is interrupted.
+        send_message(self.request, {"pid": os.getpid()})
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+
+        reset_logging()
+
+        status = run_module(request["module"], request["argv"])
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        send_message(self.request, {"status": status})
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    max_children = 256
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_request = time.monotonic()
+
+    def process_request(self, request, client_address):
+        self.last_request = time.monotonic()
+        super().process_request(request, client_address)
+
+    def idle_for(self) -> float:
+        if self.active_children:
+            self.last_request = time.monotonic()
+        return time.monotonic() - self.last_request
+
+
+def _claim_socket(path: Path):
+    """Remove a stale socket file, or fail if a server is listening on it."""
+    if not path.exists():
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            path.unlink()
+            return
+
+    raise RuntimeError(f"A server is already listening on `{path}`.")
+
+
+def serve(path: Path, *, idle_timeout: float = 0.0):
+    """
+    Serve requests on a Unix socket at `path` until interrupted.
+
+    If `idle_timeout` is positive, stop after that many seconds with
+    no requests running.
+    """
+    _claim_socket(path)
+
+    with _Server(str(path), _RequestHandler) as server:
+        server.timeout = 1.0
+
+        logger.info(f"Serving on `{path}`")
+
+        try:
+            while idle_timeout <= 0 or server.idle_for() < idle_timeout:
+                server.handle_request()
+                server.collect_children()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+
+    logger.info("Stopped.")
+
+
+def main():
+    parser = LoggingArgumentParser(logger)
+
+    parser.add_argument(
+        "--socket", default=DEFAULT_SOCKET, help="Unix socket to listen on."
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=0.0,
+        help="Stop after this many seconds with no requests. 0 means never.",
+    )
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        help="Modules to import up front. Defaults to the ones make runs.",
+    )
+
+    args = parser.parse_args()
+
+    preload(PRELOAD_MODULES if args.preload is None else args.preload)
+
+    serve(Path(args.socket), idle_timeout=args.idle_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import pandas as pd
 import yaml
 
 from evlcharts.loggingargparser import LoggingArgumentParser
+from evlcharts.results import ResultsStore
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +22,49 @@ def main():
 
     parser.add_argument("-o", "--output", required=True, type=str, help="Output file.")
 
-    parser.add_argument("params", nargs="+", help="Input parameter files")
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="Results store from optimize.py to read scores from "
+        "instead of parameter files.",
+    )
+
+    parser.add_argument(
+        "--population",
+        type=str,
+        choices=["all", "renters"],
+        default="renters",
+        help="With --results, the population to read scores for.",
+    )
+
+    parser.add_argument(
+        "-y",
+        "--y-column",
+        type=str,
+        choices=["filing_rate", "threatened_rate", "judgement_rate"],
+        default="filing_rate",
+        help="With --results, the y column to read scores for.",
+    )
+
+    parser.add_argument("params", nargs="*", help="Input parameter files")
 
     args = parser.parse_args()
 
+    if args.results is None and not args.params:
+        parser.error("Give either --results or parameter files to score.")
+
     output_path = Path(args.output)
 
+    if args.results is not None:
+        store = ResultsStore(Path(args.results))
+        df_scores = store.scores(
+            population=args.population, y_col=args.y_column, fips=args.fips
+        )
+        store.close()
+
+        df_scores.to_csv(output_path, index=False)
+        return
+
     scores = []
 
     for file in args.params:
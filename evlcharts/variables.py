@@ -1,8 +1,6 @@
 from typing import List
 
 import pandas as pd
-from censusdis import data as ced
-from censusdis.datasets import ACS5
 
 # From the population by race group https://api.census.gov/data/2018/acs/acs5/groups/B03002.html
 GROUP_HISPANIC_OR_LATINO_ORIGIN_BY_RACE = "B03002"
@@ -79,14 +77,3 @@ def x_cols(df: pd.DataFrame, renters_only: bool) -> List[str]:
         ]
 
     return cols
-
-
-def cofips_name(fips, year):
-    state_fips = fips[:2]
-    county_fips = fips[2:]
-
-    # Get name of the county from the U.S. Census servers.
-    df_county = ced.download(ACS5, year, ["NAME"], state=state_fips, county=county_fips)
-
-    county_name = df_county["NAME"].iloc[0]
-    return county_name
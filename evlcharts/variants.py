@@ -0,0 +1,84 @@
+"""
+Model several populations and y columns in one run.
+
+A variant is a population and a y column. Commands that accept more
+than one of either take output paths as templates, in which
+`{population}` and `{y}` are replaced for each variant, e.g.
+`./plots/{population}/{y}/13121`.
+"""
+
+from itertools import product
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+import evlcharts.loader as loader
+import evlcharts.variables as var
+
+Variant = Tuple[str, str]
+
+
+def all_variants(populations: Iterable[str], y_cols: Iterable[str]) -> List[Variant]:
+    """Every combination of population and y column, without repeats."""
+    return list(dict.fromkeys(product(populations, y_cols)))
+
+
+def variant_path(template: str, variant: Variant) -> Path:
+    population, y_col = variant
+    return Path(str(template).format(population=population, y=y_col))
+
+
+def variant_paths(template: str, variants: List[Variant]) -> Dict[Variant, Path]:
+    """
+    The path of each variant.
+
+    Raises
+    ------
+    ValueError
+        If two variants would share a path, because the template is
+        missing `{population}` or `{y}`.
+    """
+    paths = {variant: variant_path(template, variant) for variant in variants}
+
+    if len(set(paths.values())) < len(paths):
+        raise ValueError(
+            f"`{template}` must contain {{population}} and {{y}} to "
+            "give each population and y column its own path."
+        )
+
+    return paths
+
+
+def optional_variant_paths(
+    template: Optional[str], variants: List[Variant]
+) -> Dict[Variant, Optional[Path]]:
+    """Like :py:func:`variant_paths`, but every path is `None` if `template` is."""
+    if template is None:
+        return {variant: None for variant in variants}
+
+    return variant_paths(template, variants)
+
+
+def load_county(
+    data_path: Path, fips: str, populations: Iterable[str], y_cols: Iterable[str]
+) -> Tuple[pd.DataFrame, Dict[str, List[str]]]:
+    """
+    Read a county's data once for every population and y column.
+
+    Returns
+    -------
+        The data, with the X columns of every population, the y columns,
+        the weights and the year, and the X columns of each population.
+    """
+    df_schema = loader.read_schema(data_path)
+
+    x_cols = {
+        population: var.x_cols(df_schema, population == "renters")
+        for population in populations
+    }
+
+    columns = [col for cols in x_cols.values() for col in cols]
+    columns += list(y_cols) + [var.VARIABLE_TOTAL_RENTERS, "year"]
+
+    return loader.read_columns(data_path, columns, fips=fips), x_cols
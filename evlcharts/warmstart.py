@@ -0,0 +1,100 @@
+"""Priors for hyperparameter searches from counties that are already optimized."""
+
+import logging
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+PRIOR_STRATEGIES = ["state", "similar", "best"]
+
+
+def load_results(params_dir: Path, exclude_fips: Optional[str] = None) -> List[Dict]:
+    """Load the results of every county optimized so far in `params_dir`."""
+    results = []
+
+    for params_path in sorted(Path(params_dir).glob("xgb-params-*.yaml")):
+        with open(params_path) as f:
+            result = yaml.full_load(f)
+
+        if result is None or result.get("fips") == exclude_fips:
+            continue
+
+        results.append(result)
+
+    logger.info(f"Loaded {len(results)} optimized counties from `{params_dir}`")
+
+    return results
+
+
+def _distance(result: Dict[str, Any], rows: int, linreg_score: float) -> float:
+    """How different a county is from ours, by size and linear model score."""
+    other_rows = result.get("rows")
+    if other_rows is None:
+        return math.inf
+
+    return abs(math.log(other_rows) - math.log(rows)) + abs(
+        result["linreg"]["score"] - linreg_score
+    )
+
+
+def select_prior(
+    results: List[Dict[str, Any]],
+    fips: str,
+    *,
+    strategy: str = "state",
+    rows: Optional[int] = None,
+    linreg_score: Optional[float] = None,
+    n: int = 5,
+) -> Dict[str, Any]:
+    """
+    Choose the best params of other counties to seed a search with.
+
+    Parameters
+    ----------
+    results
+        Results of other counties, from :py:func:`load_results`.
+    fips
+        The county we are about to optimize.
+    strategy
+        `"state"` uses the best scoring counties in the same state,
+        falling back on all counties if there are none. `"similar"` uses
+        the counties closest in number of rows and linear model score.
+        `"best"` uses the best scoring counties anywhere.
+    rows
+        Rows of data in our county. Needed for `"similar"`.
+    linreg_score
+        Score of the linear model for our county. Needed for `"similar"`.
+    n
+        How many counties to take params from.
+
+    Returns
+    -------
+        A dictionary with the `"strategy"`, the `"fips"` of the counties
+        chosen, and their `"params"`.
+    """
+    if strategy == "state":
+        same_state = [result for result in results if result["fips"][:2] == fips[:2]]
+        chosen = sorted(
+            same_state or results, key=lambda result: -result["xgb"]["target"]
+        )
+    elif strategy == "similar":
+        chosen = sorted(
+            results, key=lambda result: _distance(result, rows, linreg_score)
+        )
+    elif strategy == "best":
+        chosen = sorted(results, key=lambda result: -result["xgb"]["target"])
+    else:
+        raise ValueError(f"Unknown prior strategy {strategy}.")
+
+    chosen = chosen[:n]
+
+    return {
+        "strategy": strategy,
+        "fips": [result["fips"] for result in chosen],
+        "params": [dict(result["xgb"]["params"]) for result in chosen],
+    }
@@ -2,12 +2,13 @@
 
 # This is how I build from a clean state.
 
-# Divide up the data by county.
-gmake -j 8 data
+# Divide up the data by county. This is a single pass
+# over the joined data, so there is no need for -j.
+gmake data
 
-# Optimize and produce hyperparameters.
-# No -j because optimization uses multiprocessing.
-gmake params
+# Optimize and produce hyperparameters. No -j because
+# this runs all the counties in one pool of workers.
+gmake params_batch
 
 # Plets
 gmake -j 8 plots
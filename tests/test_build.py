@@ -0,0 +1,187 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import yaml
+
+from evlcharts.build import Build, StampStore, build_targets, county_slice_hashes
+
+COUNTIES = ["13089", "13121", "17031"]
+
+
+def _joined(path: Path) -> Path:
+    rows = [
+        {
+            "STATE": fips[:2],
+            "COUNTY": fips[2:],
+            "TRACT": f"{tract:06d}",
+            "year": year,
+            "renters": 100 * tract + year - 2000,
+            "filing_rate": 0.01 * tract,
+        }
+        for fips in COUNTIES
+        for tract in range(1, 4)
+        for year in range(2010, 2013)
+    ]
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def _build(tmp_path: Path, joined_data: Path, cls=Build, **kwargs) -> Build:
+    stage_args = {"data": [], "params": [], "plot": [], "maps": []}
+    stage_args.update(kwargs.pop("stage_args", {}))
+
+    return cls(
+        joined_data=joined_data,
+        fips_codes=COUNTIES,
+        data_dir=tmp_path / "data",
+        data_format="csv",
+        params_dir=tmp_path / "params",
+        plot_dir=tmp_path / "plots",
+        bucket_dir=None,
+        bucket_format="parquet",
+        maps_dir=tmp_path / "maps",
+        stage_args=stage_args,
+        stamps=StampStore(tmp_path / "stamps.sqlite"),
+        population="renters",
+        y_col="filing_rate",
+        **kwargs,
+    )
+
+
+def _touch_outputs(driver: Build, stage: str):
+    for fips in driver.fips_codes:
+        for path in driver.outputs(stage, fips):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+
+def _stale(report):
+    return {(row["stage"], row["fips"]) for row in report}
+
+
+def test_only_changed_county_is_stale(tmp_path):
+    joined_data = _joined(tmp_path / "joined.csv")
+    driver = _build(tmp_path, joined_data)
+
+    _touch_outputs(driver, "data")
+    build_targets(driver, ["data"], mark_built=True)
+    assert build_targets(driver, ["data"], dry_run=True) == []
+
+    df = pd.read_csv(joined_data, dtype=str)
+    df.loc[(df["COUNTY"] == "121") & (df["year"] == "2011"), "renters"] = "7"
+    df.to_csv(joined_data, index=False)
+
+    report = build_targets(driver, ["data"], dry_run=True)
+
+    assert report == [{"stage": "data", "fips": "13121", "reasons": "slice changed"}]
+
+
+@pytest.mark.parametrize("chunksize", [1, 4, 7, 10, 100])
+def test_slice_hashes_do_not_depend_on_chunks(tmp_path, chunksize):
+    joined_data = _joined(tmp_path / "joined.csv")
+
+    # Missing values only in the last county, so its chunks read
+    # renters as float and the other counties' chunks read it as int.
+    df = pd.read_csv(joined_data, dtype=str)
+    df.loc[(df["COUNTY"] == "031") & (df["year"] == "2012"), "renters"] = ""
+    df.to_csv(joined_data, index=False)
+
+    whole = county_slice_hashes(joined_data, COUNTIES)
+
+    assert county_slice_hashes(joined_data, COUNTIES, chunksize=chunksize) == whole
+    assert len(set(whole.values())) == len(COUNTIES)
+
+
+def test_plot_is_stale_when_county_names_change(tmp_path):
+    joined_data = _joined(tmp_path / "joined.csv")
+    names = tmp_path / "names.csv"
+    names.write_text("fips,name\n13089,DeKalb County\n")
+
+    driver = _build(
+        tmp_path,
+        joined_data,
+        stage_args={"plot": ["--county-names", str(names), "--offline"]},
+    )
+
+    for stage in ["data", "params", "plot"]:
+        _touch_outputs(driver, stage)
+    for fips in COUNTIES:
+        driver.params_path(fips).write_text(
+            yaml.dump({"xgb": {"params": {"max_depth": 3}}, "linreg": {}})
+        )
+    build_targets(driver, ["plot"], mark_built=True)
+    assert build_targets(driver, ["plot"], dry_run=True) == []
+
+    names.write_text("fips,name\n13089,DeKalb County, Georgia\n")
+
+    assert _stale(build_targets(driver, ["plot"], dry_run=True)) == {
+        ("plot", fips) for fips in COUNTIES
+    }
+
+
+class FailingBuild(Build):
+    """Copy a fixture to each output instead of running the stage, failing some."""
+
+    def __init__(self, *, failing, fixture, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = failing
+        self.fixture = fixture
+
+    def command(self, stage, argv):
+        fips = argv[argv.index("--fips") + 1]
+
+        if (stage, fips) in self.failing:
+            return [sys.executable, "-c", "import sys; sys.exit(3)"]
+
+        [output] = self.outputs(stage, fips)
+        copy = "import shutil, sys; shutil.copy(sys.argv[1], sys.argv[2])"
+
+        return [sys.executable, "-c", copy, str(self.fixture), str(output)]
+
+
+def test_failed_stage_is_not_stamped(tmp_path):
+    joined_data = _joined(tmp_path / "joined.csv")
+    fixture = tmp_path / "fixture.yaml"
+    fixture.write_text(yaml.dump({"xgb": {"params": {"max_depth": 3}}, "linreg": {}}))
+
+    driver = _build(
+        tmp_path,
+        joined_data,
+        cls=FailingBuild,
+        failing={("params", "13121")},
+        fixture=fixture,
+    )
+
+    _touch_outputs(driver, "data")
+    driver.params_dir.mkdir()
+    driver.plot_dir.mkdir()
+    build_targets(driver, ["data"], mark_built=True)
+
+    report = build_targets(driver, ["params", "plot"])
+
+    assert _stale(report) == {
+        ("params", "13089"),
+        ("params", "13121"),
+        ("params", "17031"),
+        ("plot", "13089"),
+        ("plot", "17031"),
+    }
+    assert {
+        "stage": "params",
+        "fips": "13121",
+        "reasons": "failed with status 3",
+    } in report
+
+    assert driver.stamps.get("params", driver.target("params", "13121")) is None
+    assert driver.stamps.get("plot", driver.target("plot", "13121")) is None
+    for fips in ["13089", "17031"]:
+        assert driver.stamps.get("params", driver.target("params", fips)) is not None
+        assert driver.stamps.get("plot", driver.target("plot", fips)) is not None
+
+    # Only the failed county is left to build.
+    assert _stale(build_targets(driver, ["params", "plot"], dry_run=True)) == {
+        ("params", "13121"),
+        ("plot", "13121"),
+    }
@@ -0,0 +1,134 @@
+import asyncio
+import urllib.error
+
+import pytest
+
+from evlcharts import censusapi
+from evlcharts.censusapi import CensusClient
+from evlcharts.fakecensus import FIXTURE_NAMES, FakeCensus, serve
+
+VINTAGE = 2021
+
+# One county in each of twelve states, so each state is its own request.
+MANY_STATE_NAMES = {f"{state:02d}001": f"County {state}" for state in range(1, 13)}
+
+
+@pytest.fixture
+def fake_api():
+    """Start fake Census servers, returning each one's state and API root."""
+    servers = []
+
+    def start(names=FIXTURE_NAMES, **kwargs):
+        census = FakeCensus(names, **kwargs)
+        server = serve(census)
+        servers.append(server)
+        return census, f"http://127.0.0.1:{server.server_port}/data"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the retry delays instead of waiting for them."""
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(censusapi.asyncio, "sleep", record)
+    # Take the jitter out of the backoff.
+    monkeypatch.setattr(censusapi.random, "random", lambda: 0.5)
+
+    return delays
+
+
+def _states(names):
+    return sorted({fips[:2] for fips in names})
+
+
+def test_county_names(fake_api):
+    census, base_url = fake_api()
+    client = CensusClient(base_url=base_url)
+
+    names = client.county_names(_states(FIXTURE_NAMES), VINTAGE)
+
+    assert names == FIXTURE_NAMES
+    assert census.stats()["requests"] == len(_states(FIXTURE_NAMES))
+
+
+def test_concurrency_is_bounded(fake_api):
+    census, base_url = fake_api(MANY_STATE_NAMES, latency=0.1)
+    client = CensusClient(base_url=base_url, concurrency=3)
+
+    names = client.county_names(_states(MANY_STATE_NAMES), VINTAGE)
+
+    assert names == MANY_STATE_NAMES
+    assert census.stats()["max_in_flight"] == 3
+
+
+def test_retries_transient_failures(fake_api):
+    census, base_url = fake_api(MANY_STATE_NAMES, fail_every=3)
+    client = CensusClient(base_url=base_url, concurrency=4, backoff=0.01)
+
+    names = client.county_names(_states(MANY_STATE_NAMES), VINTAGE)
+
+    assert names == MANY_STATE_NAMES
+    assert census.stats()["failures"] > 0
+    assert client.retried == census.stats()["failures"]
+    assert client.requests == census.stats()["requests"]
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_backs_off_exponentially(fake_api, sleeps, status):
+    census, base_url = fake_api(fail_every=1, fail_status=status)
+    client = CensusClient(base_url=base_url, retries=3, backoff=0.1)
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.county_names(["13"], VINTAGE)
+
+    assert error.value.code == status
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4])
+    assert census.stats()["requests"] == 4
+
+
+def test_honors_retry_after(fake_api, sleeps):
+    # Every second request is rate limited.
+    census, base_url = fake_api(fail_every=2, fail_status=429, retry_after=7)
+    client = CensusClient(base_url=base_url, concurrency=1, backoff=0.1)
+
+    names = client.county_names(["13", "17"], VINTAGE)
+
+    assert names == {
+        fips: name for fips, name in FIXTURE_NAMES.items() if fips[:2] in ("13", "17")
+    }
+    assert sleeps == [7.0]
+    assert client.retried == 1
+
+
+def test_does_not_retry_bad_requests(fake_api, sleeps):
+    census, base_url = fake_api()
+    client = CensusClient(base_url=base_url)
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client._run([client.get(f"{VINTAGE}/acs/acs5", {"get": "POP"})])
+
+    assert error.value.code == 400
+    assert sleeps == []
+    assert census.stats()["requests"] == 1
+
+
+def test_coalesces_duplicate_requests(fake_api):
+    census, base_url = fake_api(latency=0.2)
+    client = CensusClient(base_url=base_url)
+
+    names = client.county_names(["13"] * 5, VINTAGE)
+
+    assert names == {"13089": FIXTURE_NAMES["13089"], "13121": FIXTURE_NAMES["13121"]}
+    assert census.stats()["requests"] == 1
+    assert client.coalesced == 4